@@ -0,0 +1,233 @@
+"""
+A minimal client for the local adb server (the smart-socket protocol on port 5037).
+
+Shell commands run inside a long-lived `exec:sh` session per device, so a call costs
+one write and one read on an already open socket instead of forking `adb` and
+re-doing the transport handshake. Sessions are pooled per serial and reused.
+"""
+import os
+import time
+import socket
+import struct
+import threading
+import uuid
+import re
+from shlex import quote
+from collections import defaultdict
+
+ADB_HOST = os.environ.get('ADB_SERVER_HOST', '127.0.0.1')
+ADB_PORT = int(os.environ.get('ANDROID_ADB_SERVER_PORT', 5037))
+POOL_SIZE = 4
+SHELL_TIMEOUT = 60.   # seconds a pooled shell command may take before its session is dropped
+RECV_CHUNK = 64 * 1024
+
+
+class AdbError(Exception):
+    pass
+
+class AdbUnavailable(AdbError):
+    """The adb server or the device transport could not be reached; nothing was sent to the device"""
+    pass
+
+
+def _recv_exact(sock, n:int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise AdbError('connection closed by adb server')
+        buf += chunk
+    return bytes(buf)
+
+def _read_status(sock):
+    status = _recv_exact(sock, 4)
+    if status == b'OKAY':
+        return
+    if status == b'FAIL':
+        length = int(_recv_exact(sock, 4), 16)
+        raise AdbError(_recv_exact(sock, length).decode(errors='replace'))
+    raise AdbError(f'unexpected adb status {status!r}')
+
+def _send_request(sock, req:str):
+    data = req.encode()
+    sock.sendall(b'%04x' % len(data) + data)
+    _read_status(sock)
+
+def open_service(serial:str, service:str, timeout = None) -> socket.socket:
+    """Open a socket to `service` on the device `serial`"""
+    try:
+        sock = socket.create_connection((ADB_HOST, ADB_PORT), timeout=5)
+    except OSError as e:
+        raise AdbUnavailable(f'cannot reach adb server at {ADB_HOST}:{ADB_PORT}: {e}')
+    try:
+        try:
+            _send_request(sock, f'host:transport:{serial}')
+        except (AdbError, OSError) as e:
+            raise AdbUnavailable(f'cannot switch transport to {serial}: {e}')
+        _send_request(sock, service)
+    except BaseException:
+        sock.close()
+        raise
+    sock.settimeout(timeout)
+    return sock
+
+def read_all(sock) -> bytes:
+    chunks = []
+    while True:
+        chunk = sock.recv(RECV_CHUNK)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def list_devices() -> dict:
+    """serial -> state ('device', 'offline', 'unauthorized', ...) as reported by `host:devices`"""
+    try:
+        sock = socket.create_connection((ADB_HOST, ADB_PORT), timeout=5)
+    except OSError as e:
+        raise AdbUnavailable(f'cannot reach adb server at {ADB_HOST}:{ADB_PORT}: {e}')
+    try:
+        _send_request(sock, 'host:devices')
+        payload = _recv_exact(sock, int(_recv_exact(sock, 4), 16)).decode()
+    finally:
+        sock.close()
+    return dict(line.split('\t')[:2] for line in payload.splitlines() if '\t' in line)
+
+
+class ShellSession:
+    """A persistent `sh` on the device, fed one command at a time"""
+    _END = re.compile(rb'(-?\d+)\n')
+
+    def __init__(self, serial:str):
+        self.serial = serial
+        self.sock = open_service(serial, 'exec:sh')
+        self.buf = bytearray()
+
+    def run(self, cmd:str, timeout:float = SHELL_TIMEOUT) -> bytes:
+        """Raises AdbError when no answer comes within `timeout`; the session is unusable after that"""
+        marker = ('__FV_%s__' % uuid.uuid4().hex).encode()
+        # the command runs in its own `sh -c` with a quoted argument, so unbalanced quotes or a
+        # stray `exit` in it fail that command instead of leaving the session waiting for input;
+        # the trailing printf is glued to the output so binary stdout is kept byte-exact
+        script = f"sh -c {quote(cmd)} </dev/null\nprintf '%s%d\\n' '{marker.decode()}' $?\n"
+        deadline = time.time() + timeout
+        self.sock.sendall(script.encode())
+        while True:
+            idx = self.buf.find(marker)
+            if idx >= 0:
+                m = self._END.match(self.buf, idx + len(marker))
+                if m:
+                    out = bytes(self.buf[:idx])
+                    self.returncode = int(m.group(1))
+                    del self.buf[:m.end()]
+                    return out
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise AdbError(f'shell command timed out after {timeout:.0f}s on {self.serial}: {cmd[:80]!r}')
+            self.sock.settimeout(remaining)
+            try:
+                chunk = self.sock.recv(RECV_CHUNK)
+            except socket.timeout:
+                raise AdbError(f'shell command timed out after {timeout:.0f}s on {self.serial}: {cmd[:80]!r}')
+            if not chunk:
+                raise AdbError(f'shell session to {self.serial} closed')
+            self.buf += chunk
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class AdbClient:
+    """Pools `ShellSession`s per serial and exposes the one-shot services"""
+
+    def __init__(self, pool_size:int = POOL_SIZE):
+        self.pool_size = pool_size
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def _acquire(self, serial:str) -> ShellSession:
+        with self._lock:
+            if self._idle[serial]:
+                return self._idle[serial].pop()
+        return ShellSession(serial)
+
+    def _release(self, session:ShellSession):
+        with self._lock:
+            if len(self._idle[session.serial]) < self.pool_size:
+                self._idle[session.serial].append(session)
+                return
+        session.close()
+
+    def shell(self, serial:str, cmd:str, timeout:float = SHELL_TIMEOUT) -> bytes:
+        return self.shell_status(serial, cmd, timeout)[0]
+
+    def shell_status(self, serial:str, cmd:str, timeout:float = SHELL_TIMEOUT) -> tuple:
+        """(stdout, exit status) of `cmd`"""
+        session = self._acquire(serial)
+        try:
+            out = session.run(cmd, timeout)
+        except BaseException:
+            # a timed out or interrupted session may still have output in flight, never reuse it
+            session.close()
+            raise
+        returncode = session.returncode
+        self._release(session)
+        return out, returncode
+
+    def exec_out(self, serial:str, cmd:str, timeout = None) -> bytes:
+        """One-shot `exec:` service, for large binary outputs that should not share a session"""
+        sock = open_service(serial, f'exec:{cmd}', timeout)
+        try:
+            return read_all(sock)
+        finally:
+            sock.close()
+
+    def open_exec(self, serial:str, cmd:str, timeout = None) -> socket.socket:
+        """Streaming `exec:` service; the caller reads and closes the socket"""
+        return open_service(serial, f'exec:{cmd}', timeout)
+
+    def exec_in(self, serial:str, cmd:str, data:bytes, timeout = None) -> bytes:
+        """Feed `data` to `cmd` on the device through stdin"""
+        sock = open_service(serial, f'exec:{cmd}', timeout)
+        try:
+            sock.sendall(data)
+            sock.shutdown(socket.SHUT_WR)
+            return read_all(sock)
+        finally:
+            sock.close()
+
+    def pull(self, serial:str, remote:str) -> bytes:
+        """Read a device file through the sync service"""
+        sock = open_service(serial, 'sync:')
+        try:
+            path = remote.encode()
+            sock.sendall(b'RECV' + struct.pack('<I', len(path)) + path)
+            data = bytearray()
+            while True:
+                ident, length = struct.unpack('<4sI', _recv_exact(sock, 8))
+                if ident == b'DATA':
+                    data += _recv_exact(sock, length)
+                elif ident == b'DONE':
+                    break
+                elif ident == b'FAIL':
+                    raise AdbError(_recv_exact(sock, length).decode(errors='replace'))
+                else:
+                    raise AdbError(f'unexpected sync id {ident!r}')
+            sock.sendall(b'QUIT' + struct.pack('<I', 0))
+            return bytes(data)
+        finally:
+            sock.close()
+
+    def close(self, serial:str = None):
+        with self._lock:
+            serials = [serial] if serial else list(self._idle)
+            sessions = [s for k in serials for s in self._idle.pop(k, [])]
+        for s in sessions:
+            s.close()
+
+
+client = AdbClient()
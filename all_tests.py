@@ -3,6 +3,7 @@ import traceback
 from typing import Type, Dict
 
 import util
+import transitions
 from pathlib import Path
 from infra import Event, EventSeq, Oracle, Widget, RawHierarchy, TestCase
 from setup import setup_app, uninstall_app
@@ -15,7 +16,7 @@ def save_json(path, js):
         json.dump(js, f)
 
 def save_current_json(path):
-    save_json(path, parseUIHierarchy(get_current_ui()))
+    save_json(path, parseUIHierarchy(get_current_ui_tree()))
 
 def save_ui(path):
     os.system("cp hierarchy.xml " + path)
@@ -123,12 +124,13 @@ class Simulator:
 
     def act(self: Test, action: str, attribs: dict, *param: str):
         # do action here
-        ui = self.controller.device.dump_hierarchy()
         flag = True
         cnt = 3
         while flag and cnt > 0:
             try:
-                event: Event = RawHierarchy(self.controller.device.dump_hierarchy()).buildEvent(action, attribs, *param)
+                ui = self.controller.device.dump_hierarchy()
+                event: Event = RawHierarchy(ui).buildEvent(action, attribs, *param)
+                start = time.time()
                 event.act(self.controller)
                 flag = False
             except:
@@ -140,11 +142,13 @@ class Simulator:
 
         stage = Simulator.getStage()
         idx = len(self.events)
-        print(f"SAVING {idx}-TH UI FOR {stage}")
-        with open(self.savePath / f"{stage}{idx}.xml", "w", encoding="utf-8") as f:
-            f.write(self.controller.device.dump_hierarchy())
-        print(f"SAVING {idx}-TH SCREEN SHOT FOR {stage}")
-        util.save_current_screen(self.savePath / f"{stage}{idx}.png")
+        obs = util.capture_observation()
+        print(f"SAVING {idx}-TH UI AND SCREEN SHOT FOR {stage}")
+        obs.save(self.savePath / f"{stage}{idx}.xml", self.savePath / f"{stage}{idx}.png")
+        if configs.TRANSITIONS != configs.TransitionConf.OFF:
+            transitions.get_graph().record(self.acquireApkName(), transitions.screen_key(ui), event.dumpAsDict(),
+                                           transitions.screen_key(obs.hierarchy), time.time() - start,
+                                           obs.hierarchy, obs.activity)
         self.events.append(event)
 
         self.lastStage = stage
@@ -161,9 +165,7 @@ class Simulator:
             self.lastStage = None
 
     def observeStart(self: Test):
-        with open(self.savePath / "init.xml", "w", encoding="utf-8") as f:
-            f.write(self.controller.device.dump_hierarchy())
-        util.save_current_screen(self.savePath / "init.png")
+        util.capture_observation().save(self.savePath / "init.xml", self.savePath / "init.png")
 
     def saveMetadata(self):
         print("SAVING METADATA")
@@ -204,6 +206,8 @@ class Simulator:
             return
         self.test.sizeCnt = {}
         self.test.lastStage = None
+        # Test.events is a class attribute, give each recording its own so parallel sims do not mix
+        self.test.events = EventSeq()
 
         self.test.observeStart = Simulator.observeStart.__get__(self.test, Test)
         self.test.act = Simulator.act.__get__(self.test, Test)
@@ -566,7 +570,7 @@ class GooglechromeTest(Test):
 
     @staticmethod
     def get_url():
-        tree = get_current_ui()
+        tree = get_current_ui_tree()
         full_url = tree.findall(".//node[@resource-id='com.android.chrome:id/url_bar']")[0].attrib['text']
         seps = full_url.split('/')
         if len(seps) > 1:
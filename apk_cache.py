@@ -0,0 +1,134 @@
+"""
+On-disk cache of `aapt dump badging` results, keyed by APK path, size, mtime and content hash.
+
+    python apk_cache.py [apk_dir] [-j N]     # index every APK in the directory in parallel
+"""
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+import threading
+import subprocess
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+CACHE_PATH = os.environ.get('FESTIVAL_APK_CACHE', 'apk_cache.json')
+
+_PACKAGE = re.compile(r"^package: name='([^']*)'(?: versionCode='([^']*)')?(?: versionName='([^']*)')?", re.M)
+_ACTIVITY = re.compile(r"^launchable-activity: name='([^']*)'", re.M)
+_PERMISSION = re.compile(r"^uses-permission: name='([^']*)'", re.M)
+
+
+def file_hash(path) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def badging(path) -> dict:
+    """Run aapt on one APK and keep the fields we use"""
+    out = subprocess.check_output(['aapt', 'dump', 'badging', str(path)]).decode(errors='replace')
+    package = _PACKAGE.search(out)
+    activity = _ACTIVITY.search(out)
+    return {
+        'package': package.group(1),
+        'version_code': package.group(2),
+        'version_name': package.group(3),
+        'launchable_activity': activity.group(1) if activity else None,
+        'permissions': _PERMISSION.findall(out),
+    }
+
+def index_apk(path) -> tuple:
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    info = badging(path)
+    info.update(size=st.st_size, mtime=st.st_mtime, sha256=file_hash(path))
+    return path, info
+
+
+class ApkCache:
+    def __init__(self, path:str = CACHE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def _by_hash(self, sha256:str):
+        for info in self.entries.values():
+            if info['sha256'] == sha256:
+                return info
+        return None
+
+    def get(self, apk_path) -> dict:
+        """Badging info for an APK, re-running aapt only when its content changed"""
+        path = os.path.abspath(apk_path)
+        st = os.stat(path)
+        with self.lock:
+            info = self.entries.get(path)
+        if info is not None and info['size'] == st.st_size and info['mtime'] == st.st_mtime:
+            return info
+        sha256 = file_hash(path)
+        with self.lock:
+            known = info if info is not None and info['sha256'] == sha256 else self._by_hash(sha256)
+        if known is not None:
+            info = dict(known, size=st.st_size, mtime=st.st_mtime)
+        else:
+            info = badging(path)
+            info.update(size=st.st_size, mtime=st.st_mtime, sha256=sha256)
+        with self.lock:
+            self.entries[path] = info
+        self.save()
+        return info
+
+    def warm(self, apk_dir, workers:int = None) -> int:
+        """Index every APK under `apk_dir` that is missing or stale, using a process pool"""
+        todo = []
+        for apk in sorted(Path(apk_dir).glob('*.apk')):
+            info = self.entries.get(os.path.abspath(apk))
+            st = apk.stat()
+            if info is None or info['size'] != st.st_size or info['mtime'] != st.st_mtime:
+                todo.append(str(apk))
+        if not todo:
+            return 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for path, info in pool.map(index_apk, todo):
+                self.entries[path] = info
+        self.save()
+        return len(todo)
+
+    def save(self):
+        with self.lock:
+            data = json.dumps(self.entries, indent=1)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache() -> ApkCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ApkCache()
+        return _cache
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='index APK badging info')
+    parser.add_argument('apk_dir', nargs='?', default=None)
+    parser.add_argument('-j', '--jobs', type=int, default=None)
+    args = parser.parse_args()
+    apk_dir = args.apk_dir
+    if apk_dir is None:
+        import configs
+        apk_dir = configs.apk_dir
+    n = get_cache().warm(apk_dir, args.jobs)
+    print(f'indexed {n} apk(s) from {apk_dir}', file=sys.stderr)
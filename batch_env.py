@@ -0,0 +1,106 @@
+"""
+A gym-style vectorized wrapper: K `MobileTestEnv`s, one per device, stepped together.
+
+    batch = BatchMobileTestEnv(['emulator-5554', 'emulator-5556'], get_test_tasks(), 'my_baseline')
+    observations = batch.reset()
+    while not batch.finished:
+        observations, rewards, dones = batch.step([agent(o) if o else None for o in observations])
+        for trajectory in batch.completed():
+            ...
+
+A slot whose episode ends is saved and immediately relaunched with the next queued task. Its
+`done` is True and its observation is already the new episode's first one, as in gym's vector
+envs. Slots with nothing left to run report `None` observations.
+"""
+import time
+import queue
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from mobileTask import MobileTestEnv
+
+
+class BatchMobileTestEnv:
+    def __init__(self, serials:List[str], tasks, baseline_name:str):
+        self.serials = list(serials)
+        self.tasks = deque(tasks)
+        self.baseline_name = baseline_name
+        self.envs: List[Optional[MobileTestEnv]] = [None] * len(self.serials)
+        self.started = [0.] * len(self.serials)
+        self._completed = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=len(self.serials), thread_name_prefix='batch-env')
+
+    def __len__(self):
+        return len(self.serials)
+
+    @property
+    def finished(self) -> bool:
+        return not self.tasks and all(env is None for env in self.envs)
+
+    def _launch(self, i:int):
+        """Start the next queued task in slot i; returns its first observation, None when the queue is empty"""
+        while True:
+            try:
+                # slots launch concurrently, popleft is atomic but the emptiness check is not
+                task = self.tasks.popleft()
+            except IndexError:
+                break
+            try:
+                self.envs[i] = MobileTestEnv(self.serials[i], task, self.baseline_name)
+                self.started[i] = time.time()
+                return self.envs[i].step('Init')[0]
+            except Exception:
+                self._completed.put({'test_name': task['test_name'], 'serial': self.serials[i],
+                                     'status': 'failed', 'reward': 0., 'error': traceback.format_exc()})
+        self.envs[i] = None
+        return None
+
+    def _finish(self, i:int, reward:float, error:str = None):
+        env = self.envs[i]
+        try:
+            env.save()
+        except Exception:
+            error = error or traceback.format_exc()
+        trajectory = {'test_name': env.test_name, 'serial': self.serials[i], 'reward': reward,
+                      'steps': len(env.executed_events), 'events': env.executed_events,
+                      'seconds': round(time.time() - self.started[i], 1),
+                      'status': 'failed' if error else 'done'}
+        if error:
+            trajectory['error'] = error
+        self._completed.put(trajectory)
+
+    def _step_slot(self, i:int, response):
+        if self.envs[i] is None:
+            return None, 0., True
+        try:
+            observation, reward, done = self.envs[i].step(response)
+        except Exception:
+            self._finish(i, 0., traceback.format_exc())
+            return self._launch(i), 0., True
+        if not done:
+            return observation, reward, False
+        self._finish(i, reward)
+        return self._launch(i), reward, True
+
+    def reset(self) -> list:
+        """Fill every slot with a task; returns the first observations"""
+        return list(self._pool.map(self._launch, range(len(self))))
+
+    def step(self, responses:list):
+        """One action per slot (ignored for empty slots); all devices act in parallel"""
+        results = list(self._pool.map(self._step_slot, range(len(self)), responses))
+        observations, rewards, dones = (list(x) for x in zip(*results))
+        return observations, rewards, dones
+
+    def completed(self):
+        """Trajectories finished since the last call, in completion order"""
+        while True:
+            try:
+                yield self._completed.get_nowait()
+            except queue.Empty:
+                return
+
+    def close(self):
+        self._pool.shutdown(wait=True)
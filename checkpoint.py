@@ -0,0 +1,108 @@
+"""
+Archives of an app's private data directory taken right after a successful login, restored
+before a test so `login_app` only has to run when no valid checkpoint exists.
+
+The directory is streamed off the device with tar over exec-out (as root, or through
+run-as for debuggable apps) and gzip-compressed on the host.
+"""
+import gzip
+import json
+import time
+import hashlib
+from pathlib import Path
+
+import configs
+import apk_cache
+from util import adb_shell, adb_shell_status, adb_exec_out, adb_exec_in, adb_exec, get_package_name
+
+# lib is a system-owned symlink, the caches are rebuilt by the app
+_EXCLUDES = "--exclude=./lib --exclude=./cache --exclude=./code_cache"
+RESTORE_TMP = '/data/local/tmp'
+RESTORE_TIMEOUT = 300.
+
+
+def _paths(apk:str):
+    root = Path(configs.checkpoint_dir)
+    return root / f'{apk}.tar.gz', root / f'{apk}.json'
+
+def _root_prefix() -> str:
+    """'' with adb root, 'su 0 ' with a su binary, None when only run-as is possible"""
+    if adb_shell('id -u').strip() == b'0':
+        return ''
+    if adb_shell('su 0 id -u 2>/dev/null').strip() == b'0':
+        return 'su 0 '
+    return None
+
+def _apk_hash(apk:str) -> str:
+    return apk_cache.get_cache().get(Path(configs.apk_dir) / f'{apk}.apk')['sha256']
+
+def save_checkpoint(apk:str, pkg:str = None) -> bool:
+    pkg = pkg if pkg else get_package_name(apk)
+    prefix = _root_prefix()
+    if prefix is not None:
+        cmd = f"{prefix}sh -c 'cd /data/data/{pkg} && tar -cf - {_EXCLUDES} .'"
+    else:
+        cmd = f"run-as {pkg} tar -cf - {_EXCLUDES} ."
+    data = adb_exec_out(cmd)
+    # a valid tar is a whole number of 512-byte blocks ending with two zero blocks
+    if len(data) < 1024 or len(data) % 512 or data[-1024:] != bytes(1024):
+        print(f'checkpoint of {pkg} failed: {data[:200]!r}')
+        return False
+    archive, meta = _paths(apk)
+    archive.parent.mkdir(parents=True, exist_ok=True)
+    blob = gzip.compress(data, 6)
+    with open(archive, 'wb') as f:
+        f.write(blob)
+    with open(meta, 'w') as f:
+        json.dump({'package': pkg, 'apk_sha256': _apk_hash(apk), 'archive_sha256': hashlib.sha256(blob).hexdigest(),
+                   'created': time.time(), 'root': prefix is not None}, f, indent=1)
+    return True
+
+def checkpoint_valid(apk:str) -> bool:
+    """Archive and metadata exist, are intact, recent enough and were taken from the current APK"""
+    archive, meta = _paths(apk)
+    if not archive.exists() or not meta.exists():
+        return False
+    with open(meta) as f:
+        info = json.load(f)
+    if time.time() - info['created'] > configs.checkpoint_max_age:
+        return False
+    with open(archive, 'rb') as f:
+        if hashlib.sha256(f.read()).hexdigest() != info['archive_sha256']:
+            return False
+    return info['apk_sha256'] == _apk_hash(apk)
+
+def restore_checkpoint(apk:str, pkg:str = None) -> bool:
+    """Replace the app's data with its checkpoint; False when there is no valid one"""
+    if not checkpoint_valid(apk):
+        return False
+    pkg = pkg if pkg else get_package_name(apk)
+    archive, _ = _paths(apk)
+    with open(archive, 'rb') as f:
+        data = gzip.decompress(f.read())
+    adb_exec(f'am force-stop {pkg}', 0)
+    # exec-in gives no output back, so the archive goes to a temp file first and is
+    # unpacked through the shell session, which reports the exit status
+    tmp = f'{RESTORE_TMP}/{pkg}.tar'
+    adb_exec_in(f'cat > {tmp}', data)
+    if adb_shell(f'stat -c %s {tmp}').strip() != str(len(data)).encode():
+        print(f'checkpoint restore of {pkg} failed: archive did not reach the device')
+        adb_shell(f'rm -f {tmp}')
+        return False
+    prefix = _root_prefix()
+    if prefix is not None:
+        cmd = (f"cat {tmp} | {prefix}sh -c 'cd /data/data/{pkg} && "
+               "find . -mindepth 1 -maxdepth 1 ! -name lib -exec rm -rf {} + && tar -xf - && "
+               "chown -R $(stat -c %u:%g .) . && restorecon -R .'")
+    else:
+        cmd = f"cat {tmp} | run-as {pkg} sh -c 'find . -mindepth 1 -maxdepth 1 ! -name lib -exec rm -rf {{}} + && tar -xf -'"
+    out, rc = adb_shell_status(cmd + ' 2>&1', RESTORE_TIMEOUT)
+    adb_shell(f'rm -f {tmp}')
+    if out.strip():
+        print(f'checkpoint restore of {pkg}: {out.decode(errors="replace").strip()}')
+    if rc != 0:
+        # the data directory may be half replaced, start the scripted login from a clean one
+        print(f'checkpoint restore of {pkg} failed (exit {rc})')
+        adb_exec(f'pm clear {pkg}', 0)
+        return False
+    return True
@@ -12,6 +12,25 @@ INFODISTILL: InformationDistillationConf = InformationDistillationConf.CHATGPT
 GenerationConf = Enum('GenerationConf', ['INTERACTIVE', 'SELFPLANNING', 'ONEHOP','BACKTRACK',"STATICFDTREE","NOPRUNE",'NOBACKTRACK',"DFSBACKTRACK","LOCALBACKTRACK","GLOBALBACKTRACK"])
 GENERATION: GenerationConf = GenerationConf.INTERACTIVE
 
+# FIXED: post-action waits sleep for their full budget; STABLE: the budget is only an upper
+# bound and the wait ends once the UI stops changing (see util.wait_until_stable);
+# ADAPTIVE: actions without an explicit sleep wait for the learned per-app budget (see latency.py)
+SettleConf = Enum('SettleConf', ['FIXED', 'STABLE', 'ADAPTIVE'])
+SETTLE: SettleConf = SettleConf.FIXED
+# SemanticHierarchy takes two dumps; NEVER reuses the step's single capture for both, ALWAYS
+# takes a second dump as before, TRANSITION only when the first looks mid-transition
+SecondDumpConf = Enum('SecondDumpConf', ['NEVER', 'ALWAYS', 'TRANSITION'])
+SECOND_DUMP: SecondDumpConf = SecondDumpConf.NEVER
+# cross-run transition graph (see transitions.py): OFF; RECORD every executed action with its
+# resulting screen and latency; SKIP_NOOP also skips scrolls and swipes known to leave the screen
+# unchanged (scripted tests never skip)
+TransitionConf = Enum('TransitionConf', ['OFF', 'RECORD', 'SKIP_NOOP'])
+TRANSITIONS: TransitionConf = TransitionConf.OFF
+
+# explicit waits shorter than this stay fixed and are not measured under ADAPTIVE, a stability
+# check costs a couple of dumps anyway; default waits are measured with at least this long a look
+SETTLE_MIN_WAIT = 1.0
+
 def init():
     global dev_id, apk_dir, apk_info
     dev_id = os.environ.get('ANDROID_SERIAL', 'emulator-5554')
@@ -32,5 +51,18 @@ def init():
     global seed_test_dir
     seed_test_dir = config['DEFAULT']['seed.test.dir']
 
+    # how util.ensure_reinstalled resets an app between tasks: reinstall | snapshot | data
+    global reset_mode, snapshot_max_age
+    reset_mode = config['DEFAULT'].get('reset.mode', 'reinstall')
+    snapshot_max_age = config['DEFAULT'].getfloat('snapshot.max.age.hours', 24 * 7) * 3600
+
+    global checkpoint_enabled, checkpoint_dir, checkpoint_max_age
+    checkpoint_enabled = config['DEFAULT'].getboolean('checkpoint.enabled', True)
+    checkpoint_dir = config['DEFAULT'].get('checkpoint.dir', './checkpoints')
+    checkpoint_max_age = config['DEFAULT'].getfloat('checkpoint.max.age.hours', 24 * 7) * 3600
+
+    global history_hot
+    history_hot = config['DEFAULT'].getint('history.hot.contexts', 0)
+
 
 init()
@@ -0,0 +1,167 @@
+"""
+A pool of devices that threads (or asyncio tasks) lease one at a time.
+
+Each `Device` is bound to its serial: `device.start_app(pkg=...)`, `device.capture_observation()`
+and any other `util` function run against that serial only and are serialized by a per-device
+lock, so one process can drive many emulators at once.
+
+    pool = DevicePool(['emulator-5554', 'emulator-5556'])
+    with pool.leased() as device:
+        device.restart_app('yelp')
+"""
+import time
+import asyncio
+import threading
+import subprocess
+from contextlib import contextmanager, asynccontextmanager
+
+import util
+import adb_client
+
+
+class NoDeviceAvailable(Exception):
+    pass
+
+
+class Device:
+    """util operations bound to one serial"""
+
+    def __init__(self, serial:str):
+        self.serial = serial
+        self.lock = threading.RLock()
+        self.failures = 0
+        self._controller = None
+
+    def __repr__(self):
+        return f'Device({self.serial!r})'
+
+    @contextmanager
+    def bound(self):
+        """Hold the device and bind its serial, for code that calls util/login functions directly"""
+        with self.lock, util.bind_serial(self.serial):
+            yield self
+
+    def __getattr__(self, name):
+        fn = getattr(util, name)
+        if not callable(fn):
+            raise AttributeError(name)
+        def call(*args, **kwargs):
+            with self.bound():
+                return fn(*args, **kwargs)
+        call.__name__ = name
+        return call
+
+    @property
+    def controller(self):
+        """An AndroidController on this serial, created on first use"""
+        if self._controller is None:
+            from screen_control import AndroidController
+            self._controller = AndroidController(self.serial)
+        return self._controller
+
+    def healthy(self) -> bool:
+        """Online in adb, shell answers and boot has completed"""
+        try:
+            if adb_client.list_devices().get(self.serial) != 'device':
+                return False
+        except adb_client.AdbUnavailable:
+            state = subprocess.run(['adb', '-s', self.serial, 'get-state'],
+                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+            if state.strip() != b'device':
+                return False
+        try:
+            with self.bound():
+                return util.adb_shell('getprop sys.boot_completed').strip() == b'1'
+        except (adb_client.AdbError, OSError):
+            return False
+
+
+class DevicePool:
+    """Lease/release of `Device`s with health checks; unhealthy devices are set aside"""
+
+    def __init__(self, serials = None, max_failures:int = 3):
+        if serials is None:
+            serials = [s for s, state in adb_client.list_devices().items() if state == 'device']
+        self.devices = {s: Device(s) for s in serials}
+        self.idle = list(self.devices)
+        self.quarantined = set()
+        self.max_failures = max_failures
+        self.cond = threading.Condition()
+
+    def __len__(self):
+        return len(self.devices)
+
+    def _pick(self, prefer):
+        for serial in (prefer or []):
+            if serial in self.idle:
+                return serial
+        return self.idle[0] if self.idle else None
+
+    def lease(self, timeout:float = None, prefer = None, check:bool = True) -> Device:
+        """Block until a healthy device is free; `prefer` lists serials to try first"""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self.cond:
+                while True:
+                    serial = self._pick(prefer)
+                    if serial is not None:
+                        break
+                    if len(self.quarantined) == len(self.devices):
+                        raise NoDeviceAvailable('every device in the pool is unhealthy')
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        raise NoDeviceAvailable('timed out waiting for a device')
+                    self.cond.wait(remaining)
+                self.idle.remove(serial)
+            device = self.devices[serial]
+            if not check or device.healthy():
+                return device
+            self.release(device, failed=True)
+
+    def release(self, device:Device, failed:bool = False):
+        """Give the device back; devices that fail `max_failures` times in a row are quarantined"""
+        with self.cond:
+            device.failures = device.failures + 1 if failed else 0
+            if device.failures >= self.max_failures:
+                self.quarantined.add(device.serial)
+                print(f'{device.serial} quarantined after {device.failures} failures')
+            else:
+                self.idle.append(device.serial)
+            self.cond.notify_all()
+
+    def revive(self, serial:str):
+        """Put a quarantined device back into rotation"""
+        with self.cond:
+            if serial in self.quarantined:
+                self.quarantined.discard(serial)
+                self.devices[serial].failures = 0
+                self.idle.append(serial)
+                self.cond.notify_all()
+
+    @contextmanager
+    def leased(self, timeout:float = None, prefer = None):
+        device = self.lease(timeout, prefer)
+        failed = False
+        try:
+            yield device
+        except BaseException:
+            # only count it against the device when the device itself is the problem
+            failed = not device.healthy()
+            raise
+        finally:
+            self.release(device, failed)
+
+    async def alease(self, timeout:float = None, prefer = None) -> Device:
+        return await asyncio.get_running_loop().run_in_executor(None, self.lease, timeout, prefer)
+
+    @asynccontextmanager
+    async def aleased(self, timeout:float = None, prefer = None):
+        device = await self.alease(timeout, prefer)
+        failed = False
+        try:
+            yield device
+        except BaseException:
+            failed = not device.healthy()
+            raise
+        finally:
+            self.release(device, failed)
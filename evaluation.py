@@ -0,0 +1,256 @@
+"""
+Runs a baseline over a task list on a fleet of devices.
+
+Tasks are ordered longest-first by their expected duration. That comes from historical run
+times when there are any, else from the task length: the `Length` column of Task_Info.csv,
+with the number of ground-truth steps as tie-breaker and fallback. Each device works through
+its own queue and steals from the most loaded device when it runs dry. Every task starts with
+`setup_app`; devices where that is cheap (the app is installed and its login can be restored
+from a checkpoint or snapshot) are preferred.
+Finished tasks are appended to logs/<baseline>/progress.jsonl, so an
+interrupted sweep picks up where it stopped.
+
+    python evaluation.py my_baseline mypkg.agents:make_agent -s emulator-5554 emulator-5556
+"""
+import os
+import csv
+import json
+import time
+import argparse
+import importlib
+import threading
+import traceback
+from collections import deque
+from os.path import join as pjoin
+
+import mobileTask
+from mobileTask import MobileTestEnv, get_test_tasks
+from device_pool import DevicePool, NoDeviceAvailable
+from setup import setup_app
+import login
+import snapshot
+import checkpoint
+
+TASK_INFO_PATH = 'Task_Info.csv'
+RUN_TIMES_PATH = pjoin('logs', 'run_times.json')
+SECONDS_PER_STEP = 30.
+SETUP_SECONDS = 60.       # install and scripted login
+RESTORE_SECONDS = 15.     # setup that restores a checkpoint or snapshot instead of logging in
+MAX_STEPS = 15
+
+
+def _words(s:str) -> set:
+    return set(w for w in s.lower().replace(',', ' ').replace('.', ' ').split() if len(w) > 2)
+
+def load_task_lengths(path:str = TASK_INFO_PATH) -> dict:
+    """app -> [(description words, Length)] from Task_Info.csv"""
+    lengths = {}
+    with open(path) as f:
+        for row in csv.DictReader(f):
+            lengths.setdefault(row['App'].lower(), []).append((_words(row['Brief Task Description']), int(row['Length'])))
+    return lengths
+
+def task_length(task:dict, lengths:dict) -> float:
+    """`Length` of the closest Task_Info description of the app; the number of recorded ground-truth
+    steps breaks ties between equally close descriptions and stands in when none is close"""
+    steps = None
+    body = pjoin(mobileTask.artifact_root, 'test_cases_android12', task['test_name'], 'body.json')
+    if os.path.exists(body):
+        with open(body) as f:
+            steps = len(json.load(f))
+    rows = lengths.get(task['app'], [])
+    words = _words(task['target'])
+    scored = [(len(words & w), n) for w, n in rows]
+    best = max((o for o, _ in scored), default=0)
+    if best:
+        candidates = [n for o, n in scored if o == best]
+        if steps is not None:
+            return min(candidates, key=lambda n: abs(n - steps))
+        return sum(candidates) / len(candidates)
+    if steps is not None:
+        return steps
+    if rows:
+        return sum(n for _, n in rows) / len(rows)
+    every = [n for rs in lengths.values() for _, n in rs]
+    return sum(every) / len(every) if every else MAX_STEPS / 2
+
+
+class RunTimes:
+    """Seconds per finished task across sweeps, shared by all baselines"""
+
+    def __init__(self, path:str = RUN_TIMES_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.times = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.times = json.load(f)
+
+    def estimate(self, test_name:str):
+        runs = self.times.get(test_name)
+        return sum(runs) / len(runs) if runs else None
+
+    def add(self, test_name:str, seconds:float):
+        with self.lock:
+            self.times.setdefault(test_name, []).append(round(seconds, 1))
+            self.times[test_name] = self.times[test_name][-10:]
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'w') as f:
+                json.dump(self.times, f, indent=1)
+
+
+class Scheduler:
+    def __init__(self, baseline_name:str, agent_factory, tasks, pool:DevicePool):
+        self.baseline_name = baseline_name
+        self.agent_factory = agent_factory
+        self.pool = pool
+        self.run_times = RunTimes()
+        self.lock = threading.Lock()
+        self.progress_path = pjoin('logs', baseline_name, 'progress.jsonl')
+        self.results = self._load_progress()
+        lengths = load_task_lengths()
+        self.cost = {}
+        for task in tasks:
+            est = self.run_times.estimate(task['test_name'])
+            self.cost[task['test_name']] = est if est is not None else task_length(task, lengths) * SECONDS_PER_STEP
+        # failed tasks of an interrupted sweep run again
+        done = {name for name, r in self.results.items() if r['status'] == 'done'}
+        self.tasks = sorted([t for t in tasks if t['test_name'] not in done],
+                            key=lambda t: -self.cost[t['test_name']])
+        self.cheap = {serial: set() for serial in pool.devices}
+        self.queues = {serial: deque() for serial in pool.devices}
+
+    def _load_progress(self) -> dict:
+        results = {}
+        if os.path.exists(self.progress_path):
+            with open(self.progress_path) as f:
+                for line in f:
+                    if line.strip():
+                        r = json.loads(line)
+                        results[r['test_name']] = r
+        return results
+
+    def _record(self, result:dict):
+        with self.lock:
+            self.results[result['test_name']] = result
+            os.makedirs(os.path.dirname(self.progress_path), exist_ok=True)
+            with open(self.progress_path, 'a') as f:
+                f.write(json.dumps(result) + '\n')
+
+    def _probe(self):
+        """Which apps each device has installed with a login that setup can restore"""
+        apps = {t['app'] for t in self.tasks}
+        # a checkpoint works on any device, a snapshot only on the one it was taken on
+        logged_in = {app for app in apps if not hasattr(login, f'login_{app}') or checkpoint.checkpoint_valid(app)}
+        for serial, device in self.pool.devices.items():
+            for app in apps:
+                try:
+                    if (app in logged_in or snapshot.snapshot_fresh(serial, app)) and device.check_installed(app):
+                        self.cheap[serial].add(app)
+                except Exception:
+                    pass
+
+    def _assign(self):
+        """Longest-processing-time-first, each task to the device that would finish it earliest"""
+        load = {serial: 0. for serial in self.queues}
+        # after its first task on a device the app is installed there and has a checkpoint
+        planned = {serial: set(apps) for serial, apps in self.cheap.items()}
+        def expected(serial, task):
+            return self.cost[task['test_name']] + (RESTORE_SECONDS if task['app'] in planned[serial] else SETUP_SECONDS)
+        for task in self.tasks:
+            serial = min(load, key=lambda s: load[s] + expected(s, task))
+            load[serial] += expected(serial, task)
+            self.queues[serial].append(task)
+            planned[serial].add(task['app'])
+
+    def _next(self, serial:str):
+        with self.lock:
+            if self.queues[serial]:
+                return self.queues[serial].popleft()
+            victims = [s for s in self.queues if self.queues[s]]
+            if not victims:
+                return None
+            victim = max(victims, key=lambda s: sum(self.cost[t['test_name']] for t in self.queues[s]))
+            # prefer stealing a task whose app is cheap to set up here, else the victim's shortest
+            for task in self.queues[victim]:
+                if task['app'] in self.cheap[serial]:
+                    self.queues[victim].remove(task)
+                    return task
+            return self.queues[victim].pop()
+
+    def run_task(self, device, task:dict) -> dict:
+        start = time.time()
+        reward, status = 0., 'done'
+        try:
+            # every task starts logged in and from a clean state, whatever the previous one left behind
+            with device.bound():
+                if not setup_app(task['app']):
+                    raise Exception('Setup Failed for ' + task['app'])
+            self.cheap[device.serial].add(task['app'])
+            env = MobileTestEnv(device.serial, task, self.baseline_name)
+            agent = self.agent_factory(task)
+            observation, reward, done = env.step('Init')
+            while not done:
+                observation, reward, done = env.step(agent(observation))
+            env.save()
+        except Exception:
+            status = 'failed'
+            print(f"{task['test_name']} failed on {device.serial}")
+            traceback.print_exc()
+        seconds = time.time() - start
+        if status == 'done':
+            self.run_times.add(task['test_name'], seconds)
+        return {'test_name': task['test_name'], 'reward': reward, 'status': status,
+                'seconds': round(seconds, 1), 'device': device.serial}
+
+    def _worker(self, device):
+        while True:
+            task = self._next(device.serial)
+            if task is None:
+                return
+            self._record(self.run_task(device, task))
+
+    def run(self) -> dict:
+        self._probe()
+        self._assign()
+        threads = []
+        for _ in range(len(self.pool)):
+            try:
+                device = self.pool.lease(timeout=30)
+            except NoDeviceAvailable:
+                # queues of devices that never come up are stolen by the others
+                break
+            def work(device = device):
+                try:
+                    self._worker(device)
+                finally:
+                    self.pool.release(device)
+            t = threading.Thread(target=work, name=f'eval-{device.serial}')
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        return self.results
+
+
+def load_agent_factory(spec:str):
+    """'package.module:function' -> function(task_info) returning an agent(observation) -> response"""
+    module, name = spec.split(':')
+    return getattr(importlib.import_module(module), name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='evaluate a baseline on a device fleet')
+    parser.add_argument('baseline')
+    parser.add_argument('agent', help='module:function taking a task dict and returning agent(observation)')
+    parser.add_argument('-s', '--serials', nargs='*', default=None)
+    parser.add_argument('--tasks', default=None, help='comma separated test names (default: all)')
+    args = parser.parse_args()
+
+    tasks = get_test_tasks()
+    if args.tasks:
+        wanted = set(args.tasks.split(','))
+        tasks = [t for t in tasks if t['test_name'] in wanted]
+    results = Scheduler(args.baseline, load_agent_factory(args.agent), tasks, DevicePool(args.serials)).run()
+    done = [r for r in results.values() if r['status'] == 'done']
+    print(f'{len(done)}/{len(results)} done, mean reward {sum(r["reward"] for r in done) / max(1, len(done)):.3f}')
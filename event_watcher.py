@@ -0,0 +1,161 @@
+"""
+Tails `logcat -b events` per device so callers can block until an activity resumes
+instead of polling `dumpsys window windows`.
+"""
+import re
+import subprocess
+import threading
+import time
+from collections import deque
+
+import adb_client
+
+RESUME_TAGS = {'am_on_resume_called', 'wm_on_resume_called',
+               'am_resume_activity', 'wm_resume_activity',
+               'am_focused_activity', 'wm_focused_activity',
+               'am_set_resumed_activity', 'wm_set_resumed_activity'}
+# events that name the full component (pkg/cls); `*_on_resume_called` only carries the class,
+# and its package can differ from the app's (com.espn.score_center runs com.espn.sportscenter.*)
+COMPONENT_TAGS = RESUME_TAGS | {'am_create_activity', 'wm_create_activity',
+                                'am_restart_activity', 'wm_restart_activity'}
+# -v brief: I/am_on_resume_called( 1234): [0,com.foo.MainActivity,RESUME_ACTIVITY]
+_LINE = re.compile(r'^[VDIWEF]/(\w+)\(\s*\d+\): \[(.*)\]\s*$')
+HISTORY = 256
+
+
+class ResumeEvent:
+    def __init__(self, seq:int, tag:str, names:list, packages:set):
+        self.seq = seq
+        self.time = time.time()
+        self.tag = tag
+        self.names = names
+        # packages of the named activities, when known from a component event
+        self.packages = packages
+
+    def match_activity(self, acts) -> bool:
+        return any(act in name for act in acts for name in self.names)
+
+    def match_package(self, pkg:str) -> bool:
+        return pkg in self.packages or \
+            any(name.startswith(pkg + '/') or name.startswith(pkg + '.') for name in self.names)
+
+
+class ActivityWatcher:
+    """Background reader of activity lifecycle events for one device"""
+
+    def __init__(self, serial:str):
+        self.serial = serial
+        self.events = deque(maxlen=HISTORY)
+        self.seq = 0
+        self.components = {}    # activity class -> package
+        self.cond = threading.Condition()
+        self._stopped = False
+        self._stream = None
+        self.thread = threading.Thread(target=self._run, name=f'activity-watcher-{serial}', daemon=True)
+        self.thread.start()
+
+    def _open(self):
+        cmd = 'logcat -b events -v brief -T 1'
+        try:
+            sock = adb_client.client.open_exec(self.serial, cmd)
+            self._stream = sock
+            return sock.makefile('rb')
+        except adb_client.AdbUnavailable:
+            proc = subprocess.Popen(['adb', '-s', self.serial, 'exec-out', cmd], stdout=subprocess.PIPE)
+            self._stream = proc
+            return proc.stdout
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                for raw in self._open():
+                    self._feed(raw.decode(errors='replace'))
+                    if self._stopped:
+                        return
+            except (OSError, adb_client.AdbError):
+                pass
+            time.sleep(1)
+
+    def _feed(self, line:str):
+        m = _LINE.match(line.strip())
+        if not m or m.group(1) not in COMPONENT_TAGS:
+            return
+        names = [f for f in m.group(2).split(',') if '.' in f]
+        with self.cond:
+            packages = set()
+            for name in names:
+                if '/' in name:
+                    pkg, act = name.split('/', 1)
+                    self.components[pkg + act if act.startswith('.') else act] = pkg
+                    packages.add(pkg)
+                elif name in self.components:
+                    packages.add(self.components[name])
+            if m.group(1) not in RESUME_TAGS:
+                return
+            self.seq += 1
+            self.events.append(ResumeEvent(self.seq, m.group(1), names, packages))
+            self.cond.notify_all()
+
+    def mark(self) -> int:
+        """Sequence number to pass as `since` so only events after this point count"""
+        with self.cond:
+            return self.seq
+
+    def foreground(self):
+        """(package, activity) of the latest resumed activity seen, or (None, None)"""
+        with self.cond:
+            for e in reversed(self.events):
+                for name in e.names:
+                    if '/' in name:
+                        pkg, act = name.split('/', 1)
+                        return pkg, pkg + act if act.startswith('.') else act
+                if e.names:
+                    return self.components.get(e.names[0]), e.names[0]
+        return None, None
+
+    def wait(self, pred, timeout:float, since:int = None):
+        """Block until an event after `since` satisfies `pred`; returns the event or None on timeout"""
+        deadline = time.time() + timeout
+        since = self.mark() if since is None else since
+        with self.cond:
+            while True:
+                for e in self.events:
+                    if e.seq > since and pred(e):
+                        return e
+                since = max(since, self.seq)
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+
+    def wait_for_activity(self, acts, timeout:float, since:int = None):
+        if type(acts) is str:
+            acts = [acts]
+        return self.wait(lambda e: e.match_activity(acts), timeout, since)
+
+    def wait_for_package(self, pkg:str, timeout:float, since:int = None):
+        return self.wait(lambda e: e.match_package(pkg), timeout, since)
+
+    def stop(self):
+        self._stopped = True
+        stream = self._stream
+        if isinstance(stream, subprocess.Popen):
+            stream.kill()
+        elif stream is not None:
+            stream.close()
+
+
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+def get_watcher(serial:str) -> ActivityWatcher:
+    with _watchers_lock:
+        if serial not in _watchers:
+            _watchers[serial] = ActivityWatcher(serial)
+        return _watchers[serial]
+
+def stop_watcher(serial:str):
+    with _watchers_lock:
+        watcher = _watchers.pop(serial, None)
+    if watcher is not None:
+        watcher.stop()
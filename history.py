@@ -0,0 +1,221 @@
+"""
+Episode histories that share their contexts instead of copying them, and can spill old ones to disk.
+
+`ContextHistory` behaves like the list `MobileTestEnv.contexts` used to be, but `clone()` is O(1).
+A clone shares the item list and remembers its own length. The first history to append past
+the shared end extends the list in place. Any other history copies the references up to its
+length before appending (copy-on-write), and never copies the contexts themselves. A context
+is copied only when a history asks to mutate it (`mutable(i)`).
+
+    saved = env.clone_state()      # O(1)
+    ...
+    env.contexts = saved           # or env.contexts[:k], also O(1)
+    print(saved.memory_report())
+
+With a `segment` path, only the last `hot` contexts stay in memory. Older ones are zlib-compressed
+pickles appended to a temp file next to the segment and read back on access; such reads return a
+fresh copy each time. `flush(index_path)` writes the contexts still in memory and the history's
+order, and moves the temp file over the segment, so a save only writes what is new since the
+last one and the previous episode's files stay intact until then. `load_history` reads them back.
+`close()` releases the file once the episode is over.
+"""
+import os
+import copy
+import json
+import uuid
+import zlib
+import pickle
+import weakref
+import threading
+
+
+class Segment:
+    """Append-only file of compressed pickled contexts, written under a temp name until published"""
+
+    def __init__(self, path:str):
+        self.path = path
+        self.tmp = f'{path}.{uuid.uuid4().hex[:8]}.tmp'
+        self.published = False
+        self.file = open(self.tmp, 'w+b')
+        self.lock = threading.Lock()
+
+    def write(self, context) -> tuple:
+        data = zlib.compress(pickle.dumps(context, protocol=pickle.HIGHEST_PROTOCOL), 3)
+        with self.lock:
+            self.file.seek(0, os.SEEK_END)
+            offset = self.file.tell()
+            self.file.write(data)
+        return offset, len(data)
+
+    def read(self, offset:int, length:int):
+        with self.lock:
+            self.file.seek(offset)
+            data = self.file.read(length)
+        return pickle.loads(zlib.decompress(data))
+
+    def publish(self):
+        """Move the temp file over `path`; the open handle keeps working"""
+        with self.lock:
+            self.file.flush()
+            if not self.published:
+                os.replace(self.tmp, self.path)
+                self.published = True
+
+    def close(self):
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.close()
+            if not self.published:
+                os.remove(self.tmp)
+
+
+class _Stored:
+    """A context written to the segment; `context` is kept while it is still hot"""
+    __slots__ = ('offset', 'length', 'context')
+
+    def __init__(self, offset:int, length:int, context = None):
+        self.offset, self.length, self.context = offset, length, context
+
+
+class _Family:
+    """Every history cloned from the same root, and what they share"""
+
+    def __init__(self, hot:int, segment:Segment):
+        self.members = weakref.WeakSet()
+        self.hot = hot
+        self.segment = segment
+
+
+class ContextHistory:
+    def __init__(self, items = None, hot:int = 0, segment:str = None):
+        self._items = list(items) if items is not None else []
+        self._n = len(self._items)
+        self._family = _Family(hot, Segment(segment) if segment else None)
+        self._family.members.add(self)
+
+    def clone(self) -> 'ContextHistory':
+        other = ContextHistory.__new__(ContextHistory)
+        other._items, other._n, other._family = self._items, self._n, self._family
+        self._family.members.add(other)
+        return other
+
+    @property
+    def spilling(self) -> bool:
+        return self._family.segment is not None
+
+    def _own(self):
+        # someone else appended past our end: take a private copy of our prefix
+        if self._n != len(self._items):
+            self._items = self._items[:self._n]
+
+    def _store(self, i:int, keep:bool):
+        entry = self._items[i]
+        if not isinstance(entry, _Stored):
+            entry = self._items[i] = _Stored(*self._family.segment.write(entry), entry)
+        if not keep:
+            entry.context = None
+
+    def _load(self, entry):
+        if not isinstance(entry, _Stored):
+            return entry
+        if entry.context is not None:
+            return entry.context
+        return self._family.segment.read(entry.offset, entry.length)
+
+    def append(self, context):
+        self._own()
+        self._items.append(context)
+        self._n += 1
+        family = self._family
+        if family.segment is not None and self._n > family.hot:
+            self._store(self._n - family.hot - 1, keep=False)
+
+    def truncate(self, n:int):
+        """Keep the first n contexts; clones are not affected"""
+        self._n = min(self._n, max(0, n))
+
+    def pop(self):
+        context = self[-1]
+        self._n -= 1
+        return context
+
+    def mutable(self, i:int):
+        """The context at i, copied first so changes stay in this history"""
+        i = range(self._n)[i]
+        self._items = self._items[:self._n]
+        self._items[i] = copy.deepcopy(self._load(self._items[i]))
+        return self._items[i]
+
+    def flush(self, index_path:str):
+        """Write the contexts not in the segment yet, and the order of this history next to it"""
+        if self._family.segment is None:
+            raise ValueError('history has no segment')
+        for i in range(self._n):
+            self._store(i, keep=True)
+        entries = [[e.offset, e.length] for e in self._items[:self._n]]
+        tmp = index_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'segment': os.path.basename(self._family.segment.path), 'entries': entries}, f)
+        self._family.segment.publish()
+        os.replace(tmp, index_path)
+
+    def close(self):
+        """Release the segment of this history and its clones; spilled contexts cannot be read afterwards"""
+        if self._family.segment is not None:
+            self._family.segment.close()
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self._n)
+            if start == 0 and step == 1:
+                other = self.clone()
+                other.truncate(stop)
+                return other
+            return ContextHistory(self._load(e) for e in self._items[:self._n][i])
+        return self._load(self._items[range(self._n)[i]])
+
+    def __iter__(self):
+        for i in range(self._n):
+            yield self._load(self._items[i])
+
+    def __repr__(self):
+        return f'ContextHistory({self._n} contexts)'
+
+    def __reduce__(self):
+        return ContextHistory, (list(self),)
+
+    def memory_report(self) -> dict:
+        """Bytes (pickled size) of the in-memory contexts held by this history and its clones.
+        `shared` counts contexts held by more than one of them once, `deepcopy` is what copying every
+        history would hold, `spilled` is the compressed size of the contexts only on disk"""
+        holders, spilled = {}, {}
+        for history in list(self._family.members):
+            for entry in history._items[:history._n]:
+                if isinstance(entry, _Stored) and entry.context is None:
+                    spilled[entry.offset] = entry.length
+                    continue
+                context = entry.context if isinstance(entry, _Stored) else entry
+                holders.setdefault(id(context), [context, 0])[1] += 1
+        report = {'histories': len(self._family.members), 'contexts': len(holders),
+                  'shared': 0, 'unique': 0, 'deepcopy': 0, 'spilled': sum(spilled.values())}
+        for context, n in holders.values():
+            size = len(pickle.dumps(context, protocol=pickle.HIGHEST_PROTOCOL))
+            report['shared' if n > 1 else 'unique'] += size
+            report['deepcopy'] += size * n
+        return report
+
+
+def load_history(index_path:str) -> list:
+    """The contexts written by `ContextHistory.flush`, in order"""
+    with open(index_path) as f:
+        index = json.load(f)
+    with open(os.path.join(os.path.dirname(index_path), index['segment']), 'rb') as f:
+        contexts = []
+        for offset, length in index['entries']:
+            f.seek(offset)
+            contexts.append(pickle.loads(zlib.decompress(f.read(length))))
+    return contexts
@@ -0,0 +1,110 @@
+"""
+Observed settle times per (app, action kind, activity, fixed sleep), persisted as JSON, and the
+adaptive waits derived from them. A budget only replaces the fixed sleep it was learned under,
+so a 0.5 s tap wait never picks up the samples of a caller that sleeps 5 s after the same tap.
+
+    python latency.py            # wasted-sleep report per app
+"""
+import json
+import os
+import threading
+import atexit
+import math
+
+STATS_PATH = os.environ.get('FESTIVAL_LATENCY_STATS', 'latency_stats.json')
+MIN_SAMPLES = 5
+MAX_SAMPLES = 200
+QUANTILE = 0.95
+MARGIN = 0.2          # seconds added on top of the quantile
+EXPLORE_EVERY = 10    # keep measuring one in N adaptive waits so the model follows the app
+
+
+def _key(app:str, kind:str, activity:str, fixed:float) -> str:
+    return f'{app}|{kind}|{activity}|{fixed:g}'
+
+def quantile(values, q:float) -> float:
+    values = sorted(values)
+    pos = (len(values) - 1) * q
+    lo, hi = math.floor(pos), math.ceil(pos)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+class LatencyStore:
+    """Per-key settle-time samples plus what a fixed sleep would have cost at the same point"""
+
+    def __init__(self, path:str = STATS_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.dirty = 0
+        if os.path.exists(path):
+            with open(path) as f:
+                self.stats = json.load(f)
+
+    def record(self, app:str, kind:str, activity:str, settled:float, fixed:float):
+        """`settled` is the measured settle time, `fixed` the hand-tuned sleep for the same action"""
+        with self.lock:
+            entry = self.stats.setdefault(_key(app, kind, activity, fixed),
+                                          {'samples': [], 'count': 0, 'fixed': 0., 'settled': 0., 'adaptive': 0})
+            entry['samples'] = (entry['samples'] + [round(settled, 3)])[-MAX_SAMPLES:]
+            entry['count'] += 1
+            entry['fixed'] += fixed
+            entry['settled'] += settled
+            self.dirty += 1
+            flush = self.dirty >= 20
+        if flush:
+            self.save()
+
+    def budget(self, app:str, kind:str, activity:str, fixed:float):
+        """p95 + margin of the settle times observed where `fixed` was slept before, or None while
+        there are too few samples"""
+        with self.lock:
+            entry = self.stats.get(_key(app, kind, activity, fixed))
+            if entry is None or len(entry['samples']) < MIN_SAMPLES:
+                return None
+            entry['adaptive'] += 1
+            return quantile(entry['samples'], QUANTILE) + MARGIN
+
+    def should_explore(self, app:str, kind:str, activity:str, fixed:float) -> bool:
+        entry = self.stats.get(_key(app, kind, activity, fixed))
+        return entry is None or entry['adaptive'] % EXPLORE_EVERY == 0
+
+    def save(self):
+        with self.lock:
+            data = json.dumps(self.stats)
+            self.dirty = 0
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+
+    def waste_report(self) -> dict:
+        """Per app: measured actions, total hand-tuned sleep, total settle time and their difference"""
+        report = {}
+        with self.lock:
+            for key, entry in self.stats.items():
+                app = key.split('|')[0]
+                r = report.setdefault(app, {'actions': 0, 'fixed': 0., 'settled': 0., 'wasted': 0.})
+                r['actions'] += entry['count']
+                r['fixed'] += entry['fixed']
+                r['settled'] += entry['settled']
+                r['wasted'] += max(0., entry['fixed'] - entry['settled'])
+        return dict(sorted(report.items(), key=lambda kv: -kv[1]['wasted']))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store() -> LatencyStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = LatencyStore()
+            atexit.register(lambda: _store.dirty and _store.save())
+        return _store
+
+
+if __name__ == '__main__':
+    print(f"{'app':40} {'actions':>8} {'fixed(s)':>10} {'settled(s)':>11} {'wasted(s)':>10}")
+    for app, r in get_store().waste_report().items():
+        print(f"{app:40} {r['actions']:8d} {r['fixed']:10.1f} {r['settled']:11.1f} {r['wasted']:10.1f}")
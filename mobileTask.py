@@ -2,17 +2,28 @@ from context import Context
 import xml.etree.ElementTree as ET
 from hierarchy import SemanticHierarchy
 import logging
-import copy
 import json
-from util import get_package_name
+from util import get_package_name, capture_observation, activity_watcher, wait_for_package, settle
+from util import serial_scoped, Observation
+import configs
+import transitions
+from restore import StateRestorer
+from history import ContextHistory
+from screen_control import AndroidController
 from infra import Event
 import os
 from os.path import join as pjoin
 from setup import setup_app
 import re
 from typing import List, Tuple, Callable
+from functools import lru_cache
 import time
 import joblib
+import weakref
+import numpy as np
+import asyncio
+import inspect
+from concurrent.futures import ThreadPoolExecutor
 
 artifact_root = "."
 
@@ -41,9 +52,8 @@ def x_center_in_y(x:tuple,y:tuple):
     return False
 
 def single_event_match(e,ground_truth_event,hierarchy):
-    def filter_func(node):
-        return x_center_in_y(parseBound(node.get('bounds')),parseBound(ground_truth_event['bounds']))
-    required_nodes = [{'text':w.get('text'),'content-desc':w.get('content-desc'),'action':ground_truth_event['action']} for w in filter(filter_func,hierarchy.iter())]
+    nodes = bounds_index(hierarchy).query(parseBound(ground_truth_event['bounds']))
+    required_nodes = [{'text':w.get('text'),'content-desc':w.get('content-desc'),'action':ground_truth_event['action']} for w in nodes]
     for event in required_nodes:
         if ((e['text'] == event['text'] and event['text'].strip(' ')!="") or (e['content-desc'] == event['content-desc'] and event['content-desc']!='')) and e['action']==event['action']:
             return True
@@ -71,64 +81,171 @@ def parseBound(bounds: str):
     return tuple(map(lambda x: int(x), [x1, y1, x2, y2]))
 
 
+class BoundsIndex:
+    """Uniform grid over the widget centers of one hierarchy.
+    `query(box)` gives the same nodes, in document order, as filtering `hierarchy.iter()` with x_center_in_y"""
+    CELL = 128
+
+    def __init__(self, hierarchy):
+        self.nodes = []
+        rects = []
+        for w in hierarchy.iter():
+            b = parseBound(w.get('bounds'))
+            if b is not None:
+                self.nodes.append(w)
+                rects.append(b)
+        rects = np.array(rects, dtype=np.int64).reshape(-1, 4)
+        # doubled centers stay integral, so the containment test is exact
+        self.cx2 = rects[:, 0] + rects[:, 2]
+        self.cy2 = rects[:, 1] + rects[:, 3]
+        self.cells = {}
+        for i, cell in enumerate(zip((self.cx2 // (2 * self.CELL)).tolist(), (self.cy2 // (2 * self.CELL)).tolist())):
+            self.cells.setdefault(cell, []).append(i)
+        self.cells = {cell: np.array(ids) for cell, ids in self.cells.items()}
+
+    def query(self, box:tuple) -> list:
+        if box is None or not self.nodes:
+            return []
+        gx0, gy0, gx1, gy1 = (v // self.CELL for v in box)
+        if (gx1 - gx0 + 1) * (gy1 - gy0 + 1) < len(self.cells):
+            found = [self.cells[(gx, gy)] for gx in range(gx0, gx1 + 1) for gy in range(gy0, gy1 + 1) if (gx, gy) in self.cells]
+        else:
+            # a box covering most of the screen: cheaper to scan the occupied cells
+            found = [ids for (gx, gy), ids in self.cells.items() if gx0 <= gx <= gx1 and gy0 <= gy <= gy1]
+        if not found:
+            return []
+        ids = np.sort(np.concatenate(found))
+        cx2, cy2 = self.cx2[ids], self.cy2[ids]
+        keep = ids[(cx2 >= 2 * box[0]) & (cx2 <= 2 * box[2]) & (cy2 >= 2 * box[1]) & (cy2 <= 2 * box[3])]
+        return [self.nodes[i] for i in keep.tolist()]
+
+_bounds_indexes = weakref.WeakKeyDictionary()
+
+def bounds_index(hierarchy) -> BoundsIndex:
+    """The index of a parsed hierarchy, built on first use and dropped with the hierarchy"""
+    index = _bounds_indexes.get(hierarchy)
+    if index is None:
+        index = _bounds_indexes[hierarchy] = BoundsIndex(hierarchy)
+    return index
+
+
+class GroundTruthIndex:
+    """Everything `evaluate` needs from a test's recorded ground truth, loaded and parsed once"""
+
+    def __init__(self, test_name, root=None):
+        root = root if root is not None else artifact_root
+        with open(pjoin(root, "test_cases_android12", test_name, "body.json"), 'r') as fp:
+            self.events = json.load(fp)
+        files = os.listdir(pjoin(root, 'test_cases_android12', test_name))
+        files = [f for f in files if f.endswith(".xml") and f.startswith('body')]
+        files.sort(key = lambda x:int(x.split('.')[0][4:]))
+        files.insert(0,'init.xml')
+        self.files = files
+        self.hierarchies = {}
+        for f in files[:len(self.events)]:
+            with open(pjoin(root, 'test_cases', test_name, f), 'r') as fp:
+                self.hierarchies[f] = ET.fromstring(fp.read())
+        # per ground-truth event: texts / content-descs of the widgets whose center lies in its bounds
+        self.texts, self.descs = [], []
+        for i, g in enumerate(self.events):
+            box = parseBound(g['bounds'])
+            nodes = bounds_index(self.hierarchies[files[i]]).query(box)
+            self.texts.append({w.get('text') for w in nodes if w.get('text') is not None and w.get('text').strip(' ') != ''})
+            self.descs.append({w.get('content-desc') for w in nodes if w.get('content-desc') is not None and w.get('content-desc') != ''})
+
+    def match(self, i, e) -> bool:
+        """Same result as single_event_match(e, events[i], <hierarchy of step i>)"""
+        return e['action'] == self.events[i]['action'] and (e['text'] in self.texts[i] or e['content-desc'] in self.descs[i])
+
+@lru_cache(maxsize=128)
+def load_ground_truth(test_name, root=None) -> GroundTruthIndex:
+    """Process-wide cache, shared by every env and baseline evaluating the same test"""
+    return GroundTruthIndex(test_name, root)
+
+
 class MobileTestEnv():
-    def __init__(self,port,task_info,baseline_name):
+    def __init__(self,port,task_info,baseline_name,launch=True):
         # task_info: {"app": app,  "target": target, "test_name": test_name}
-        self.contexts = []
+        self.contexts = ContextHistory()
         self.target = task_info['target']
         self.app= task_info['app']
         self.pkg = get_package_name(self.app)
         self.test_name = task_info['test_name']
-        os.environ['ANDROID_SERIAL'] = port
+        # every device call of this env goes to `port`, so several envs can share a process
+        self.serial = port
+        self.controller = AndroidController(port)
 
         self.attempt_cnt = 0
         self.executed_events = []
         self.ground_truth_events = json.load(open(pjoin(f"{artifact_root}/test_cases_android12",self.test_name,"body.json"),'r'))
         
         self.termination_event = self.ground_truth_events[-1]
+        self.baseline_name = baseline_name
+        # device work of the async API runs here, one call at a time and in order
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'env-{port}')
 
+        if launch:
+            self.reset()
+
+    @serial_scoped
+    def reset(self):
+        """Relaunch the app and start a new episode"""
+        self.contexts.close()
+        self.contexts = self._new_history()
+        self.attempt_cnt = 0
+        self.executed_events = []
         self.controller.stop_app(self.pkg)
         self.controller.start_app(self.pkg)
-        time.sleep(15)
+        settle(15)
         #setup_app(self.app)
-        self.contexts.append(Context(self.controller.app_info()[1], self.target,
-                       SemanticHierarchy(self.pkg, self.app, self.controller.dump(),
-                                         self.controller.dump())))
-        self.contexts:List[Context]
-        self.baseline_name = baseline_name
+        self.contexts.append(self.observe(assure=False))
+        self.contexts:ContextHistory
+        self.restorer = StateRestorer(self, self.last_screen)
+        self.screens = [self.last_screen]
 
-    # WARNING: only works with android 12
-    def evaluate(self):
-        files = os.listdir(pjoin('test_cases_android12',f"{self.test_name}"))
-        files = [f for f in files if f.endswith(".xml") and f.startswith('body')]
-        files.sort(key = lambda x:int(x.split('.')[0][4:]))
-        files.insert(0,'init.xml')
+    def _new_history(self) -> ContextHistory:
+        """Unbounded in memory, or spilling to the episode's log directory past `history.hot.contexts`"""
+        if configs.history_hot <= 0:
+            return ContextHistory()
+        log_dir = f"logs/{self.baseline_name}/{self.test_name}"
+        os.makedirs(log_dir, exist_ok=True)
+        return ContextHistory(hot=configs.history_hot, segment=pjoin(log_dir, "contexts.seg"))
+
+    @classmethod
+    async def acreate(cls, port, task_info, baseline_name):
+        """Construct without blocking the event loop; the launch runs in the env's executor"""
+        env = cls(port, task_info, baseline_name, launch=False)
+        await env.areset()
+        return env
 
-        needed = files[len(self.ground_truth_events) - 1]
-        with open(pjoin('test_cases',f"{self.test_name}",needed),'r') as fp:
-            hierarchy_str = fp.read()
-        hierarchy = ET.fromstring(hierarchy_str)
+    async def areset(self):
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.reset)
 
-        last_one = self.ground_truth_events[-1]
+    async def astep(self, action_response):
+        """`step` in the env's executor, so other envs and model calls run meanwhile"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.step, action_response)
+
+    async def asave(self):
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.save)
+
+    # WARNING: only works with android 12
+    def evaluate(self):
+        index = load_ground_truth(self.test_name)
+        last = len(self.ground_truth_events) - 1
         for event in self.executed_events:
-            if single_event_match(event,last_one, hierarchy):
+            if index.match(last, event):
                 return 1.
         completion_all = len(self.ground_truth_events)
         complete_ones = 0
-        for i, g in enumerate(self.ground_truth_events):
-            needed = files[i]
-            with open(pjoin('test_cases',f"{self.test_name}",needed),'r') as fp:
-                hierarchy_str = fp.read()
-            hierarchy = ET.fromstring(hierarchy_str)
-            for event in self.executed_events:
-                if single_event_match(event,g,hierarchy):
-                    complete_ones += 1
-                    break
+        for i in range(completion_all):
+            if any(index.match(i, event) for event in self.executed_events):
+                complete_ones += 1
         compl_rate = complete_ones/completion_all
         return  compl_rate
     
-    def clone_state(self):
-        return copy.deepcopy(self.contexts)
+    def clone_state(self) -> ContextHistory:
+        """O(1): the clone shares every context with `self.contexts` (see history.py)"""
+        return self.contexts.clone()
     
     def oracleTerminate(self,last_event:Event):
         if self.termination_event is not None and last_event is not None:
@@ -138,6 +255,7 @@ class MobileTestEnv():
             return True, self.evaluate()   
         return False, 0 
     
+    @serial_scoped
     def step(self, action_response):
         self.attempt_cnt += 1
 
@@ -154,14 +272,27 @@ class MobileTestEnv():
         # observation, info = webshop_text(**self.sessions[session])
         
         event = self.parse_response(action_response,self.contexts[-1].getEvents())
-        event.act(self.controller)
-        self.executed_events.append(event.dumpAsDict())
-        self.assure_in_app()
-        current_context = Context(self.controller.app_info()[1], self.target,
-                       SemanticHierarchy(self.pkg, self.app, self.controller.dump(),
-                                         self.controller.dump()))
+        executed = event.dumpAsDict()
+        graph = transitions.get_graph() if configs.TRANSITIONS != configs.TransitionConf.OFF else None
+        src = self.last_screen
+        if configs.TRANSITIONS == configs.TransitionConf.SKIP_NOOP and graph.skippable(src, executed):
+            # the screen would not change, rebuild the context from the last capture
+            logging.info('%s step %d: skipped a known no-op', self.test_name, self.attempt_cnt)
+            self.executed_events.append(executed)
+            current_context = self._context(self.last_observation)
+        else:
+            start = time.time()
+            event.act(self.controller)
+            self.executed_events.append(executed)
+            current_context = self.observe()
+            seconds = time.time() - start
+            self.restorer.record(src, event, self.last_screen, seconds)
+            if graph:
+                obs = self.last_observation
+                graph.record(self.app, src, executed, self.last_screen, seconds, obs.hierarchy, obs.activity)
         events = current_context.getEvents()
         self.contexts.append(current_context)
+        self.screens.append(self.last_screen)
         elemDesc = [f"index-{i}: {x.dump()}" for i, x in enumerate(events)]
         
         observation_ = f"Currently we have {len(elemDesc)} widgets, namely:\n" + '\n'.join(elemDesc)
@@ -172,20 +303,68 @@ class MobileTestEnv():
             
         return observation_, reward, done
     
+    def observe(self, assure=True) -> Context:
+        """Capture the screen once and build the step's context from it.
+        The capture is kept in `last_observation` for the oracle and logging"""
+        obs = capture_observation(screen=False)
+        if assure and obs.package != self.pkg:
+            self.assure_in_app()
+            obs = capture_observation(screen=False)
+        second = obs.hierarchy
+        if configs.SECOND_DUMP == configs.SecondDumpConf.ALWAYS or \
+                (configs.SECOND_DUMP == configs.SecondDumpConf.TRANSITION and obs.in_transition(self.pkg)):
+            second = self.controller.dump()
+        self.last_observation: Observation = obs
+        self.last_screen = transitions.screen_key(obs.hierarchy)
+        logging.info('%s step %d: %s (%d bytes)', self.test_name, self.attempt_cnt, obs.activity, len(obs.hierarchy))
+        return self._context(obs, second)
+
+    def _context(self, obs:Observation, second:str = None) -> Context:
+        return Context(obs.activity, self.target, SemanticHierarchy(self.pkg, self.app, obs.hierarchy,
+                                                                    second if second is not None else obs.hierarchy))
+
+    def predict(self, action_response):
+        """(observation, confidence) the action led to in earlier runs, without touching the device;
+        None when the transition graph has not seen it from the current screen"""
+        event = self.parse_response(action_response, self.contexts[-1].getEvents())
+        src = self.last_screen
+        graph = transitions.get_graph()
+        expected = graph.expected_screen(src, event.dumpAsDict())
+        if expected is None:
+            return None
+        hierarchy, activity = expected
+        events = Context(activity, self.target, SemanticHierarchy(self.pkg, self.app, hierarchy, hierarchy)).getEvents()
+        elemDesc = [f"index-{i}: {x.dump()}" for i, x in enumerate(events)]
+        observation_ = f"Currently we have {len(elemDesc)} widgets, namely:\n" + '\n'.join(elemDesc)
+        return observation_, graph.predict(src, event.dumpAsDict())[1]
+
+    @serial_scoped
     def assure_in_app(self):
         if self.controller.app_info()[0] != self.pkg:
+            since = activity_watcher().mark()
             self.controller.back()
-            time.sleep(10)
+            wait_for_package(self.pkg, 10, since)
         
         if self.controller.app_info()[0] != self.pkg:
             self.controller.stop_app(self.pkg)
-            time.sleep(5)
+            settle(5)
+            since = activity_watcher().mark()
             self.controller.start_app(self.pkg)
-            time.sleep(15)
+            wait_for_package(self.pkg, 15, since)
         
         if self.controller.app_info()[0] != self.pkg:
             print('critical error: restart app failed')
         return 
+    @serial_scoped
+    def restore(self, index:int) -> bool:
+        """Bring the device back to the screen of contexts[index] by the cheapest measured route
+        (back presses, a replay from launch or a snapshot, see restore.py); the screen reached is
+        appended as a new context either way"""
+        ok = self.restorer.restore(self.screens[index])
+        self.contexts.append(self._context(self.last_observation))
+        self.screens.append(self.last_screen)
+        return ok
+
     def findFirstInteger(self, s: str):
         if re.search(r'\d+', s) is None:
             return None
@@ -204,6 +383,7 @@ class MobileTestEnv():
         #if 'index-none' in response:
         #    return -1
         #raise NotImplementedError("How to deal with the situation where chatgpt cannot give any index?")
+    @serial_scoped
     def uninstall_app(self):
         self.controller.stop_app(self.pkg)
         return self.controller.device.app_uninstall(self.pkg)
@@ -212,4 +392,25 @@ class MobileTestEnv():
         
         os.makedirs(f"logs/{self.baseline_name}/{self.test_name}",exist_ok=True)  
         json.dump(self.executed_events,open(f"logs/{self.baseline_name}/{self.test_name}/event.json",'w'))
-        joblib.dump(self.contexts,f"logs/{self.baseline_name}/{self.test_name}/context.pkl")
+        if self.contexts.spilling:
+            # only the contexts that are still in memory get written
+            self.contexts.flush(f"logs/{self.baseline_name}/{self.test_name}/contexts.idx")
+        else:
+            joblib.dump(list(self.contexts),f"logs/{self.baseline_name}/{self.test_name}/context.pkl")
+
+
+async def arun_episode(env: MobileTestEnv, agent):
+    """Drive one env to the end; `agent(observation)` may be a coroutine function (e.g. an async LLM call)"""
+    observation, reward, done = await env.astep('Init')
+    while not done:
+        if inspect.iscoroutinefunction(agent):
+            response = await agent(observation)
+        else:
+            response = await asyncio.get_running_loop().run_in_executor(None, agent, observation)
+        observation, reward, done = await env.astep(response)
+    await env.asave()
+    return reward
+
+async def arun_episodes(envs: List[MobileTestEnv], agents):
+    """Run many envs concurrently on one loop: while one waits on its device, others wait on the model"""
+    return await asyncio.gather(*[arun_episode(env, agent) for env, agent in zip(envs, agents)])
@@ -0,0 +1,141 @@
+"""
+Records ground truth (`Simulator.sim`) for many tests across several emulators.
+
+Tests are pulled from a shared queue by one worker per device. Tests that already have an
+`index.json` are skipped, and a failed test is retried on a different device when possible.
+A per-test summary of device, attempts, time and status is written at the end.
+
+    python parallel_record.py -s emulator-5554 emulator-5556 --filter audible
+"""
+import json
+import time
+import queue
+import argparse
+import threading
+import traceback
+from pathlib import Path
+
+from all_tests import Simulator, getTestList
+from device_pool import DevicePool, NoDeviceAvailable
+
+SUMMARY_PATH = Path('.') / 'test_cases' / 'record_summary.json'
+
+
+class RecordJob:
+    def __init__(self, test:dict):
+        self.test = test
+        self.name = test['test'].__name__
+        self.attempts = 0
+        self.tried = []
+
+
+class ParallelRecorder:
+    def __init__(self, pool:DevicePool, tests, retries:int = 2, init:bool = True):
+        self.pool = pool
+        self.retries = retries
+        self.init = init
+        self.jobs = queue.Queue()
+        self.summary = {}
+        self.lock = threading.Lock()
+        self.live = set()    # serials whose worker is still running
+        for test in tests:
+            if (Path('.') / 'test_cases' / test['test'].__name__ / 'index.json').exists():
+                self.summary[test['test'].__name__] = {'status': 'exists'}
+            else:
+                self.jobs.put(RecordJob(test))
+
+    def _record(self, job:RecordJob, device):
+        job.attempts += 1
+        job.tried.append(device.serial)
+        start = time.time()
+        try:
+            with device.bound():
+                Simulator(job.test['test'], device.serial).sim(self.init)
+            status, error = 'recorded', None
+        except Exception:
+            status, error = 'failed', traceback.format_exc()
+        with self.lock:
+            self.summary[job.name] = {'status': status, 'device': device.serial, 'attempts': job.attempts,
+                                      'seconds': round(time.time() - start, 1), 'devices': list(job.tried)}
+            if error:
+                self.summary[job.name]['error'] = error
+        return status == 'recorded'
+
+    def _worker(self, device):
+        try:
+            while True:
+                try:
+                    job = self.jobs.get(timeout=1)
+                except queue.Empty:
+                    # a job still running elsewhere may fail and come back for this device
+                    if self.jobs.unfinished_tasks == 0:
+                        return
+                    continue
+                # a retry goes to a device it has not failed on, as long as such a worker is still running
+                with self.lock:
+                    untried = self.live - set(job.tried)
+                if device.serial in job.tried and untried and job.attempts <= self.retries:
+                    self.jobs.put(job)
+                    self.jobs.task_done()
+                    time.sleep(0.5)
+                    continue
+                ok = self._record(job, device)
+                if not ok and job.attempts <= self.retries:
+                    print(f'{job.name} failed on {device.serial}, requeued')
+                    self.jobs.put(job)
+                self.jobs.task_done()
+                if not ok and not device.healthy():
+                    print(f'{device.serial} is unhealthy, its worker stops')
+                    return
+        finally:
+            with self.lock:
+                self.live.discard(device.serial)
+
+    def run(self) -> dict:
+        threads = []
+        for _ in range(len(self.pool)):
+            try:
+                device = self.pool.lease(timeout=30)
+            except NoDeviceAvailable:
+                break
+            with self.lock:
+                self.live.add(device.serial)
+            def work(device = device):
+                try:
+                    self._worker(device)
+                finally:
+                    self.pool.release(device)
+            t = threading.Thread(target=work, name=f'recorder-{device.serial}')
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        while not self.jobs.empty():
+            job = self.jobs.get()
+            self.summary.setdefault(job.name, {'status': 'not run'})
+        self.save()
+        return self.summary
+
+    def save(self):
+        SUMMARY_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with open(SUMMARY_PATH, 'w') as f:
+            json.dump(self.summary, f, indent=4)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='record ground truth on several emulators')
+    parser.add_argument('-s', '--serials', nargs='*', default=None, help='devices to use (default: all online)')
+    parser.add_argument('--filter', default=None, help='only tests whose name contains this (case-insensitive)')
+    parser.add_argument('--retries', type=int, default=2)
+    parser.add_argument('--no-init', action='store_true', help='skip setup_app before each test')
+    args = parser.parse_args()
+
+    tests = getTestList()
+    if args.filter:
+        tests = [t for t in tests if args.filter.lower() in t['test'].__name__.lower()]
+    recorder = ParallelRecorder(DevicePool(args.serials), tests, args.retries, not args.no_init)
+    summary = recorder.run()
+    counts = {}
+    for r in summary.values():
+        counts[r['status']] = counts.get(r['status'], 0) + 1
+    print(counts, f'summary in {SUMMARY_PATH}')
@@ -0,0 +1,125 @@
+"""
+`MobileTestEnv` without a device: observations come from the recorded ground truth.
+
+The episode walks the trace in test_cases_android12/<test>. State i shows the hierarchy recorded
+before ground-truth event i: init.xml first, then body<i-1>.xml. An action that matches event i
+moves to state i + 1, as `evaluate` or `oracleTerminate` would match it. A back press returns
+to the previous state. Any other action is off the trace: nothing is known about where it
+leads, so it counts as a dead end and the screen stays put. Scoring is the live env's, so
+rewards are comparable.
+
+    env = ReplayMobileTestEnv(task, 'my_baseline')
+    observation, reward, done = env.step('Init')
+    while not done:
+        observation, reward, done = env.step(agent(observation))
+    env.save()
+"""
+import json
+import logging
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join as pjoin, exists
+
+import mobileTask
+from mobileTask import MobileTestEnv, load_ground_truth, elem_equal
+from context import Context
+from hierarchy import SemanticHierarchy
+from util import get_package_name
+from history import ContextHistory
+
+
+@lru_cache(maxsize=128)
+def load_trace(test_name:str) -> tuple:
+    """The recorded hierarchies of a test, in trace order (one more than there are events)"""
+    index = load_ground_truth(test_name)
+    screens = []
+    for f in index.files[:len(index.events) + 1]:
+        path = pjoin(mobileTask.artifact_root, 'test_cases_android12', test_name, f)
+        if not exists(path):
+            path = pjoin(mobileTask.artifact_root, 'test_cases', test_name, f)
+        with open(path, 'r', encoding='utf-8') as fp:
+            screens.append(fp.read())
+    return tuple(screens)
+
+
+class ReplayMobileTestEnv(MobileTestEnv):
+    def __init__(self, task_info, baseline_name, launch=True):
+        self.contexts = ContextHistory()
+        self.target = task_info['target']
+        self.app = task_info['app']
+        self.pkg = get_package_name(self.app)
+        self.test_name = task_info['test_name']
+        self.serial = None
+        self.controller = None
+
+        self.attempt_cnt = 0
+        self.executed_events = []
+        self.ground_truth_events = load_ground_truth(self.test_name).events
+        self.termination_event = self.ground_truth_events[-1]
+        self.baseline_name = baseline_name
+        self.trace = load_trace(self.test_name)
+        self.position = 0
+        self.dead_ends = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='replay-env')
+
+        if launch:
+            self.reset()
+
+    def reset(self):
+        self.contexts = ContextHistory()
+        self.attempt_cnt = 0
+        self.executed_events = []
+        self.position = 0
+        self.dead_ends = 0
+        self.contexts.append(self.observe())
+
+    def on_trace(self, event:dict) -> bool:
+        """Whether `event` is the recorded transition out of the current state"""
+        i = self.position
+        if i >= len(self.ground_truth_events):
+            return False
+        return load_ground_truth(self.test_name).match(i, event) or elem_equal(self.ground_truth_events[i], event)
+
+    def step(self, action_response):
+        if action_response == 'Init':
+            return super().step(action_response)
+        self.attempt_cnt += 1
+        event = self.parse_response(action_response, self.contexts[-1].getEvents())
+        executed = event.dumpAsDict()
+        self.executed_events.append(executed)
+        if self.on_trace(executed):
+            self.position += 1
+        elif executed['action'] == 'back' and self.position > 0:
+            self.position -= 1
+        else:
+            self.dead_ends += 1
+            logging.info('%s step %d: off-trace action at state %d', self.test_name, self.attempt_cnt, self.position)
+        current_context = self.observe()
+        self.contexts.append(current_context)
+        elemDesc = [f"index-{i}: {x.dump()}" for i, x in enumerate(current_context.getEvents())]
+        observation_ = f"Currently we have {len(elemDesc)} widgets, namely:\n" + '\n'.join(elemDesc)
+        done, reward = self.oracleTerminate(event)
+        return observation_, reward, done
+
+    def observe(self, assure=True) -> Context:
+        # the trace does not record the focused activity, the package stands in for it
+        screen = self.trace[min(self.position, len(self.trace) - 1)]
+        return Context(self.pkg, self.target, SemanticHierarchy(self.pkg, self.app, screen, screen))
+
+    def restore(self, index:int) -> bool:
+        raise NotImplementedError('a replay has no device to restore, start a new episode with reset()')
+
+    def predict(self, action_response):
+        raise NotImplementedError('a replay has no transition graph, use step() instead')
+
+    def assure_in_app(self):
+        return
+
+    def uninstall_app(self):
+        return
+
+    def save(self):
+        super().save()
+        with open(pjoin('logs', self.baseline_name, self.test_name, 'replay.json'), 'w') as fp:
+            json.dump({'position': self.position, 'trace_length': len(self.ground_truth_events),
+                       'dead_ends': self.dead_ends}, fp)
@@ -0,0 +1,164 @@
+"""
+Getting back to an earlier state of an episode, for the backtracking generation modes.
+
+Every step of a `MobileTestEnv` adds an edge (screen, event, screen) with its measured latency
+to the episode's graph, keyed by `transitions.screen_key`. To return to a screen, three routes
+are priced from those measurements:
+
+- back: press back until the screen is popped off the navigation stack
+- replay: restart the app and take the cheapest known forward path from the launch screen
+- snapshot: load an emulator snapshot taken earlier (`StateRestorer.snapshot`), then the
+  cheapest forward path from the snapshot's screen
+
+The cheapest route runs first. The screen is checked afterwards, and the next route is tried
+if it does not match.
+"""
+import time
+import heapq
+import logging
+
+import snapshot
+from util import settle, activity_watcher, wait_for_package
+from infra import Event
+from latency import quantile
+
+BACK_SECONDS = 2.          # until a back press has been measured
+RESTART_SECONDS = 20.      # stop, start and the 15 s launch wait of MobileTestEnv.reset
+SNAPSHOT_SECONDS = 15.
+
+
+class EpisodeGraph:
+    def __init__(self, launch:str):
+        self.launch = launch
+        self.edges = {}          # src -> dst -> (Event, [seconds])
+        self.stack = [launch]    # the screens a back press would return through
+
+    def add(self, src:str, event:Event, dst:str, seconds:float):
+        if event.dumpAsDict()['action'] == 'back':
+            if len(self.stack) > 1 and self.stack[-2] == dst:
+                self.stack.pop()
+            else:
+                self.stack = [dst]
+            return
+        if src != dst:
+            _, samples = self.edges.setdefault(src, {}).setdefault(dst, (event, []))
+            samples.append(seconds)
+            self.stack.append(dst)
+
+    def cost(self, src:str, dst:str) -> float:
+        return quantile(self.edges[src][dst][1], 0.5)
+
+    def shortest(self, sources:dict, target:str):
+        """(cost, source, [events]) of the cheapest forward path; `sources` maps screen -> start cost"""
+        # the counter keeps ties from comparing paths
+        heap = [(c, i, s, s, []) for i, (s, c) in enumerate(sources.items())]
+        heapq.heapify(heap)
+        pushed = len(heap)
+        done = set()
+        while heap:
+            c, _, node, source, path = heapq.heappop(heap)
+            if node == target:
+                return c, source, path
+            if node in done:
+                continue
+            done.add(node)
+            for dst, (event, _) in self.edges.get(node, {}).items():
+                if dst not in done:
+                    pushed += 1
+                    heapq.heappush(heap, (c + self.cost(node, dst), pushed, dst, source, path + [event]))
+        return None
+
+
+class StateRestorer:
+    def __init__(self, env, launch:str):
+        self.env = env
+        self.graph = EpisodeGraph(launch)
+        self.snapshots = {}      # screen -> emulator snapshot name
+        self.measured = {'back': [], 'restart': [], 'snapshot': []}
+
+    def _seconds(self, kind:str, default:float) -> float:
+        return quantile(self.measured[kind], 0.5) if self.measured[kind] else default
+
+    def record(self, src:str, event:Event, dst:str, seconds:float):
+        if event.dumpAsDict()['action'] == 'back':
+            self.measured['back'].append(seconds)
+        self.graph.add(src, event, dst, seconds)
+
+    def snapshot(self):
+        """Snapshot the emulator at the current screen, for states that will be revisited often"""
+        key = self.env.last_screen
+        name = f'festival_state_{key}'
+        snapshot.save_snapshot(self.env.serial, name)
+        self.snapshots[key] = name
+
+    def routes(self, target:str) -> list:
+        """[(estimated seconds, kind, detail)] cheapest first"""
+        routes = []
+        stack = self.graph.stack
+        if target in stack[:-1]:
+            presses = len(stack) - 1 - max(i for i, s in enumerate(stack) if s == target)
+            routes.append((presses * self._seconds('back', BACK_SECONDS), 'back', presses))
+        elif target == self.env.last_screen:
+            routes.append((0., 'back', 0))
+        path = self.graph.shortest({self.graph.launch: self._seconds('restart', RESTART_SECONDS)}, target)
+        if path is not None:
+            routes.append((path[0], 'replay', path[2]))
+        if self.snapshots:
+            path = self.graph.shortest({s: self._seconds('snapshot', SNAPSHOT_SECONDS) for s in self.snapshots}, target)
+            if path is not None:
+                routes.append((path[0], 'snapshot', path[1:]))
+        return sorted(routes, key=lambda r: r[0])
+
+    def _replay(self, events):
+        for event in events:
+            start = time.time()
+            src = self.env.last_screen
+            event.act(self.env.controller)
+            self.env.observe(assure=False)
+            self.record(src, event, self.env.last_screen, time.time() - start)
+
+    def _run(self, kind:str, detail):
+        env = self.env
+        start = time.time()
+        if kind == 'back':
+            for _ in range(detail):
+                src = env.last_screen
+                Event.back().act(env.controller)
+                env.observe(assure=False)
+                self.record(src, Event.back(), env.last_screen, time.time() - start)
+                start = time.time()
+        elif kind == 'replay':
+            since = activity_watcher().mark()
+            env.controller.stop_app(env.pkg)
+            env.controller.start_app(env.pkg)
+            wait_for_package(env.pkg, 15, since)
+            settle(5)
+            env.observe(assure=False)
+            self.measured['restart'].append(time.time() - start)
+            self.graph.stack = [env.last_screen]
+            self._replay(detail)
+        else:
+            source, events = detail
+            if not snapshot.load_snapshot(env.serial, self.snapshots[source]):
+                del self.snapshots[source]
+                return
+            env.observe(assure=False)
+            self.measured['snapshot'].append(time.time() - start)
+            self.graph.stack = [env.last_screen]
+            self._replay(events)
+
+    def restore(self, target:str) -> bool:
+        """Drive the device back to screen `target`; False when no route got there"""
+        tried = set()
+        while True:
+            # routes are re-priced after a miss, the device is somewhere else by then
+            routes = [r for r in self.routes(target) if r[1] not in tried]
+            if not routes:
+                return False
+            estimate, kind, detail = routes[0]
+            tried.add(kind)
+            start = time.time()
+            self._run(kind, detail)
+            logging.info('restore via %s: estimated %.1fs, took %.1fs', kind, estimate, time.time() - start)
+            if self.env.last_screen == target:
+                return True
@@ -0,0 +1,140 @@
+"""
+Scores logged runs offline: logs/<baseline>/<test>/event.json against the recorded ground truth.
+
+For each test, the ground truth and every run's executed events are loaded into columnar
+arrays. Strings are interned to integer codes, and actions become codes too. The
+(ground truth x executed) match matrix comes from one broadcast. The numbers are the ones the
+live env reports: `success` is oracleTerminate's elem_equal hit on the termination event, and
+`completion` is MobileTestEnv.evaluate. Tests are spread over a process pool.
+
+    python scoring.py my_baseline other_baseline -j 8
+"""
+import os
+import json
+import argparse
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from os.path import join as pjoin
+
+import numpy as np
+
+from mobileTask import load_ground_truth
+
+MAX_ATTEMPTS = 15
+
+
+class Interner:
+    def __init__(self):
+        self.codes = {}
+
+    def __call__(self, s) -> int:
+        return self.codes.setdefault(s, len(self.codes))
+
+    def many(self, values) -> np.ndarray:
+        return np.array([self(v) for v in values], dtype=np.int64)
+
+
+def _member(candidates, intern:Interner, n_codes:int) -> np.ndarray:
+    """[ground truth x code] -> whether the interned string is among that step's candidates"""
+    table = np.zeros((len(candidates), n_codes), dtype=bool)
+    for g, strings in enumerate(candidates):
+        ids = [intern.codes[s] for s in strings if s in intern.codes]
+        table[g, ids] = True
+    return table
+
+
+def score_runs(test_name:str, runs:dict) -> dict:
+    """runs: name -> executed events (Event.dumpAsDict() dicts); returns name -> scores"""
+    index = load_ground_truth(test_name)
+    n_gt = len(index.events)
+    texts, descs, actions = Interner(), Interner(), Interner()
+    gt_action = actions.many(g['action'] for g in index.events)
+    term = index.events[-1]
+    scores = {}
+    columns = {}
+    for name, events in runs.items():
+        columns[name] = (texts.many(e['text'] for e in events), descs.many(e['content-desc'] for e in events),
+                         actions.many(e['action'] for e in events))
+    # interning every run first lets all of them share the candidate tables
+    text_in = _member(index.texts, texts, len(texts.codes))
+    desc_in = _member(index.descs, descs, len(descs.codes))
+    for name, events in runs.items():
+        text, desc, action = columns[name]
+        n = len(events)
+        if n == 0:
+            scores[name] = {'success': False, 'reward': 0., 'completion': 0., 'steps': 0}
+            continue
+        # match[g, e] is GroundTruthIndex.match(g, events[e])
+        match = (gt_action[:, None] == action[None, :]) & (text_in[:, text] | desc_in[:, desc])
+        completion = 1. if match[-1].any() else float(match.any(axis=1).sum()) / n_gt
+        # elem_equal(termination_event, event) for every executed event
+        term_hit = np.zeros(n, dtype=bool)
+        if term['action'] != 'back':
+            for key, strip in (('resource-id', False), ('text', True), ('content-desc', False)):
+                if term[key] is not None and (term[key].strip(' ') if strip else term[key]) != '':
+                    term_hit |= np.array([e[key] == term[key] for e in events], dtype=bool)
+            term_hit &= np.array([e['action'] != 'back' for e in events], dtype=bool)
+        success = bool(term_hit.any())
+        # Init counts as an attempt, so the env gives up after MAX_ATTEMPTS - 1 actions
+        if success:
+            reward = 1.
+        elif n + 1 >= MAX_ATTEMPTS:
+            reward = completion
+        else:
+            reward = 0.
+        scores[name] = {'success': success, 'reward': reward, 'completion': completion, 'steps': n}
+    return scores
+
+
+def _score_test(args):
+    test_name, paths = args
+    runs = {}
+    for baseline, path in paths.items():
+        with open(path) as f:
+            runs[baseline] = json.load(f)
+    try:
+        return test_name, score_runs(test_name, runs)
+    except FileNotFoundError:
+        return test_name, {baseline: {'error': 'no ground truth'} for baseline in paths}
+
+
+def collect(baselines, log_root:str = 'logs') -> dict:
+    """test -> {baseline: event.json path} for every logged run"""
+    tests = defaultdict(dict)
+    for baseline in baselines:
+        root = pjoin(log_root, baseline)
+        if not os.path.isdir(root):
+            continue
+        for test_name in os.listdir(root):
+            path = pjoin(root, test_name, 'event.json')
+            if os.path.exists(path):
+                tests[test_name][baseline] = path
+    return tests
+
+
+def score_baselines(baselines, log_root:str = 'logs', workers:int = None) -> dict:
+    """baseline -> test -> scores"""
+    results = {baseline: {} for baseline in baselines}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # one task per test, so its ground truth is loaded once for all baselines
+        for test_name, scores in pool.map(_score_test, collect(baselines, log_root).items(), chunksize=4):
+            for baseline, s in scores.items():
+                results[baseline][test_name] = s
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='score logged runs against the ground truth')
+    parser.add_argument('baselines', nargs='+')
+    parser.add_argument('-j', '--workers', type=int, default=None)
+    parser.add_argument('--logs', default='logs')
+    args = parser.parse_args()
+
+    results = score_baselines(args.baselines, args.logs, args.workers)
+    for baseline, tests in results.items():
+        with open(pjoin(args.logs, baseline, 'scores.json'), 'w') as f:
+            json.dump(tests, f, indent=1)
+        scored = [s for s in tests.values() if 'error' not in s]
+        n = max(1, len(scored))
+        print(f'{baseline}: {len(scored)} runs, success {sum(s["success"] for s in scored) / n:.3f}, '
+              f'completion {sum(s["completion"] for s in scored) / n:.3f}, reward {sum(s["reward"] for s in scored) / n:.3f}')
@@ -0,0 +1,121 @@
+"""
+Per-app emulator snapshots through the emulator console (`avd snapshot save/load`),
+used to reset an app to a clean, logged-in state without reinstalling it.
+"""
+import os
+import json
+import time
+import socket
+import threading
+from pathlib import Path
+
+import configs
+import adb_client
+import apk_cache
+
+META_PATH = os.environ.get('FESTIVAL_SNAPSHOT_META', 'snapshots.json')
+_meta_lock = threading.Lock()
+
+
+class ConsoleError(Exception):
+    pass
+
+
+class EmulatorConsole:
+    """Line-based client for the console an emulator listens on (port = the number in emulator-NNNN)"""
+
+    def __init__(self, serial:str, timeout:float = 120):
+        if not serial.startswith('emulator-'):
+            raise ConsoleError(f'{serial} is not an emulator')
+        self.sock = socket.create_connection(('127.0.0.1', int(serial.split('-')[1])), timeout=5)
+        self.sock.settimeout(timeout)
+        self.file = self.sock.makefile('rb')
+        self._read_reply()
+        token_path = Path.home() / '.emulator_console_auth_token'
+        if token_path.exists():
+            self.command(f'auth {token_path.read_text().strip()}')
+
+    def _read_reply(self) -> str:
+        lines = []
+        while True:
+            line = self.file.readline()
+            if not line:
+                raise ConsoleError('emulator console closed the connection')
+            line = line.decode(errors='replace').rstrip('\r\n')
+            if line == 'OK':
+                return '\n'.join(lines)
+            if line.startswith('KO'):
+                raise ConsoleError(line)
+            lines.append(line)
+
+    def command(self, cmd:str) -> str:
+        self.sock.sendall(cmd.encode() + b'\n')
+        return self._read_reply()
+
+    def close(self):
+        try:
+            self.command('quit')
+        except (ConsoleError, OSError):
+            pass
+        self.sock.close()
+
+
+def snapshot_name(apk:str) -> str:
+    return f'festival_{apk}'
+
+def _load_meta() -> dict:
+    if os.path.exists(META_PATH):
+        with open(META_PATH) as f:
+            return json.load(f)
+    return {}
+
+def _apk_hash(apk:str) -> str:
+    return apk_cache.get_cache().get(Path(configs.apk_dir) / f'{apk}.apk')['sha256']
+
+def save_snapshot(serial:str, name:str):
+    console = EmulatorConsole(serial)
+    try:
+        console.command(f'avd snapshot save {name}')
+    finally:
+        console.close()
+
+def load_snapshot(serial:str, name:str) -> bool:
+    """False when the console refuses; adb connections are reset on success"""
+    try:
+        console = EmulatorConsole(serial)
+        try:
+            console.command(f'avd snapshot load {name}')
+        finally:
+            console.close()
+    except (ConsoleError, OSError) as e:
+        print(f'snapshot {name} failed to load on {serial}: {e}')
+        return False
+    # connections opened before the load point at the pre-snapshot adbd
+    adb_client.client.close(serial)
+    return True
+
+def save_app_snapshot(serial:str, apk:str):
+    """Snapshot the whole emulator; call once the app is installed, set up and logged in"""
+    save_snapshot(serial, snapshot_name(apk))
+    with _meta_lock:
+        meta = _load_meta()
+        meta.setdefault(serial, {})[apk] = {'name': snapshot_name(apk), 'sha256': _apk_hash(apk),
+                                            'created': time.time()}
+        with open(META_PATH, 'w') as f:
+            json.dump(meta, f, indent=1)
+
+def snapshot_fresh(serial:str, apk:str) -> bool:
+    """A snapshot exists for this device and was taken from the APK currently on disk, recently enough"""
+    with _meta_lock:
+        info = _load_meta().get(serial, {}).get(apk)
+    if info is None:
+        return False
+    if time.time() - info['created'] > configs.snapshot_max_age:
+        return False
+    return info['sha256'] == _apk_hash(apk)
+
+def restore_app_snapshot(serial:str, apk:str) -> bool:
+    """Load the app's snapshot; False when it is missing, stale or the console refuses"""
+    if not snapshot_fresh(serial, apk):
+        return False
+    return load_snapshot(serial, snapshot_name(apk))
@@ -0,0 +1,150 @@
+"""
+A transition graph shared across runs and baselines: (screen, action) -> resulting screens.
+
+Screens are keyed by `screen_key`, a stable hash of the hierarchy with volatile nodes (clocks,
+progress) left out. Actions are keyed by their `Event.dumpAsDict()`. Each edge counts where the
+action led and how long it took, and the resulting hierarchies are kept so an expected
+observation can be served without touching the device. Enabled by `configs.TRANSITIONS`.
+
+    python transitions.py        # coverage per app
+"""
+import os
+import json
+import gzip
+import atexit
+import hashlib
+import threading
+
+from util import ui_signature
+from latency import quantile
+
+STORE_DIR = os.environ.get('FESTIVAL_TRANSITIONS', 'transitions')
+MAX_SAMPLES = 50
+MIN_NOOP_SAMPLES = 2   # an action has to leave the screen unchanged this often before it is skipped
+# actions that only move the view; anything else may change app state (a like, a cart) without
+# changing the screen, so it is never skipped
+SIDE_EFFECT_FREE = {'scroll', 'swipe'}
+
+
+def screen_key(xml) -> str:
+    return hashlib.sha1(repr(ui_signature(xml)).encode('utf-8')).hexdigest()[:16]
+
+def event_key(event:dict) -> str:
+    return hashlib.sha1(json.dumps(event, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+class TransitionGraph:
+    def __init__(self, root:str = STORE_DIR):
+        self.root = root
+        self.path = os.path.join(root, 'graph.json')
+        self.lock = threading.Lock()
+        self.edges = {}
+        self.screens = {}
+        self.dirty = 0
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            self.edges, self.screens = data['edges'], data['screens']
+
+    def _screen_path(self, key:str) -> str:
+        return os.path.join(self.root, 'screens', key + '.xml.gz')
+
+    def record(self, app:str, src:str, event:dict, dst:str, seconds:float, dst_xml:str = None, activity:str = None):
+        with self.lock:
+            edge = self.edges.setdefault(f'{src}|{event_key(event)}',
+                                         {'app': app, 'src': src, 'event': event, 'results': {}, 'latency': [], 'count': 0})
+            edge['results'][dst] = edge['results'].get(dst, 0) + 1
+            edge['latency'] = (edge['latency'] + [round(seconds, 3)])[-MAX_SAMPLES:]
+            edge['count'] += 1
+            self.screens.setdefault(src, {'app': app, 'activity': None})
+            new_screen = dst not in self.screens
+            self.screens.setdefault(dst, {'app': app, 'activity': activity})
+            self.dirty += 1
+            flush = self.dirty >= 20
+        if new_screen and dst_xml is not None:
+            os.makedirs(os.path.dirname(self._screen_path(dst)), exist_ok=True)
+            with gzip.open(self._screen_path(dst), 'wt', encoding='utf-8') as f:
+                f.write(dst_xml)
+        if flush:
+            self.save()
+
+    def lookup(self, src:str, event:dict):
+        return self.edges.get(f'{src}|{event_key(event)}')
+
+    def predict(self, src:str, event:dict):
+        """(most frequent resulting screen, share of the runs that ended there), None if never seen"""
+        edge = self.lookup(src, event)
+        if edge is None:
+            return None
+        dst, n = max(edge['results'].items(), key=lambda kv: kv[1])
+        return dst, n / edge['count']
+
+    def expected_screen(self, src:str, event:dict):
+        """(hierarchy, activity) the action most likely leads to, None if unknown"""
+        predicted = self.predict(src, event)
+        if predicted is None or not os.path.exists(self._screen_path(predicted[0])):
+            return None
+        with gzip.open(self._screen_path(predicted[0]), 'rt', encoding='utf-8') as f:
+            return f.read(), self.screens[predicted[0]]['activity']
+
+    def is_noop(self, src:str, event:dict) -> bool:
+        """The action has always left this screen unchanged"""
+        edge = self.lookup(src, event)
+        return edge is not None and edge['count'] >= MIN_NOOP_SAMPLES and list(edge['results']) == [src]
+
+    def skippable(self, src:str, event:dict) -> bool:
+        """A no-op that is also free of side effects, so not executing it changes nothing"""
+        return event.get('action') in SIDE_EFFECT_FREE and self.is_noop(src, event)
+
+    def expected_latency(self, src:str, event:dict):
+        edge = self.lookup(src, event)
+        return quantile(edge['latency'], 0.5) if edge else None
+
+    def coverage(self) -> dict:
+        """Per app: screens seen, screens acted on, distinct edges, no-op and deterministic edges, mean latency"""
+        report = {}
+        with self.lock:
+            for key, screen in self.screens.items():
+                report.setdefault(screen['app'], {'screens': 0, 'explored': set(), 'edges': 0, 'noop': 0,
+                                                  'deterministic': 0, 'actions': 0, 'seconds': 0.})['screens'] += 1
+            for edge in self.edges.values():
+                r = report[edge['app']]
+                r['explored'].add(edge['src'])
+                r['edges'] += 1
+                r['noop'] += list(edge['results']) == [edge['src']]
+                r['deterministic'] += len(edge['results']) == 1
+                r['actions'] += edge['count']
+                r['seconds'] += sum(edge['latency']) / len(edge['latency']) * edge['count']
+        for r in report.values():
+            r['explored'] = len(r['explored'])
+            r['mean_latency'] = r.pop('seconds') / r['actions'] if r['actions'] else 0.
+        return report
+
+    def save(self):
+        with self.lock:
+            data = json.dumps({'edges': self.edges, 'screens': self.screens})
+            self.dirty = 0
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+
+
+_graph = None
+_graph_lock = threading.Lock()
+
+def get_graph() -> TransitionGraph:
+    global _graph
+    with _graph_lock:
+        if _graph is None:
+            _graph = TransitionGraph()
+            atexit.register(lambda: _graph.dirty and _graph.save())
+        return _graph
+
+
+if __name__ == '__main__':
+    print(f"{'app':40} {'screens':>8} {'explored':>9} {'edges':>6} {'noop':>5} {'determ.':>8} {'actions':>8} {'latency(s)':>11}")
+    for app, r in sorted(get_graph().coverage().items()):
+        print(f"{app:40} {r['screens']:8d} {r['explored']:9d} {r['edges']:6d} {r['noop']:5d} "
+              f"{r['deterministic']:8d} {r['actions']:8d} {r['mean_latency']:11.2f}")
@@ -1,9 +1,20 @@
 import os, subprocess, time
+import threading
+import contextvars
+import functools
+from contextlib import contextmanager
+import struct, zlib
+from concurrent.futures import ThreadPoolExecutor
 import re
 from xml.etree import ElementTree as ET
 from pathlib import Path
 
 import configs
+import adb_client
+import event_watcher
+import latency
+import apk_cache
+import snapshot
 
 def slice_dict(dict, keys):
     return {k : dict[k] for k in keys}
@@ -23,21 +34,258 @@ def transform_bounds(bounds:str):
 def in_bounds(bounds, point):
     return point[0] >= bounds[0] and point[0] <= bounds[2] and point[1] >= bounds[1] and point[1] <= bounds[3]
 
-def adb_exec(cmd:str, sleep = 0.5):
+_bound_serial = contextvars.ContextVar('bound_serial', default=None)
+
+def current_serial() -> str:
+    """The serial bound by `bind_serial` in this thread/task, else $ANDROID_SERIAL, else configs.dev_id"""
+    return _bound_serial.get() or os.environ.get('ANDROID_SERIAL', configs.dev_id)
+
+@contextmanager
+def bind_serial(serial:str):
+    """Run every util operation inside the block against `serial`"""
+    token = _bound_serial.set(serial)
+    try:
+        yield serial
+    finally:
+        _bound_serial.reset(token)
+
+def serial_scoped(method):
+    """Bind `self.serial` for the duration of a method call"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with bind_serial(self.serial):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+def adb_shell(cmd:str, timeout:float = adb_client.SHELL_TIMEOUT) -> bytes:
+    """Run `cmd` in the device shell and return its stdout; raises AdbError past `timeout` seconds"""
+    try:
+        return adb_client.client.shell(current_serial(), cmd, timeout)
+    except adb_client.AdbUnavailable:
+        return subprocess.run(['adb', '-s', current_serial(), 'shell', cmd], stdout=subprocess.PIPE, timeout=timeout).stdout
+
+def adb_shell_status(cmd:str, timeout:float = adb_client.SHELL_TIMEOUT) -> tuple:
+    """(stdout, exit status) of `cmd` in the device shell"""
+    try:
+        return adb_client.client.shell_status(current_serial(), cmd, timeout)
+    except adb_client.AdbUnavailable:
+        proc = subprocess.run(['adb', '-s', current_serial(), 'shell', cmd], stdout=subprocess.PIPE, timeout=timeout)
+        return proc.stdout, proc.returncode
+
+def adb_exec_out(cmd:str) -> bytes:
+    """Like `adb exec-out`: binary-safe stdout of a single command"""
+    try:
+        return adb_client.client.exec_out(current_serial(), cmd)
+    except adb_client.AdbUnavailable:
+        return subprocess.run(['adb', '-s', current_serial(), 'exec-out', cmd], stdout=subprocess.PIPE).stdout
+
+DEFAULT_SLEEP = 0.5
+# actions whose settle time is learned under SettleConf.ADAPTIVE
+ADAPTIVE_KINDS = {'tap', 'swipe', 'keyevent', 'text', 'monkey', 'am', 'pm', 'wait'}
+
+def action_kind(cmd:str) -> str:
+    words = cmd.split()
+    if not words:
+        return 'wait'
+    return words[1] if words[0] == 'input' and len(words) > 1 else words[0]
+
+def adb_exec_in(cmd:str, data:bytes) -> bytes:
+    """Like `adb exec-in`: feed `data` to `cmd` through stdin"""
+    try:
+        return adb_client.client.exec_in(current_serial(), cmd, data)
+    except adb_client.AdbUnavailable:
+        return subprocess.run(['adb', '-s', current_serial(), 'exec-in', cmd], input=data, stdout=subprocess.PIPE).stdout
+
+def adb_exec(cmd:str, sleep = None) -> bytes:
+    """`sleep=None` waits the default 0.5 s, or the learned budget under SettleConf.ADAPTIVE"""
     # print(cmd)
-    os.system('adb shell ' + cmd)
-    time.sleep(sleep)
+    out = adb_shell(cmd)
+    settle(sleep, action_kind(cmd))
+    return out
+
+VOLATILE_CLASSES = ('ProgressBar', 'SeekBar', 'Chronometer', 'TextClock', 'VideoView', 'SurfaceView')
+VOLATILE_IDS = re.compile(r'clock|time|progress|timer|countdown|elapsed', re.I)
+VOLATILE_TEXT = re.compile(r'^\s*\d{1,2}:\d{2}(:\d{2})?\s*([AaPp][Mm])?\s*$|^\s*\d+(\.\d+)?\s*%\s*$')
+
+def ui_signature(xml) -> tuple:
+    """The hierarchy without nodes expected to change on a settled screen (clocks, progress).
+    checked and selected are kept, toggles and tabs change nothing else"""
+    parts = []
+    for node in ET.fromstring(xml).iter('node'):
+        cls, rid, text = node.get('class', ''), node.get('resource-id', ''), node.get('text', '')
+        if cls.endswith(VOLATILE_CLASSES) or VOLATILE_IDS.search(rid):
+            continue
+        parts.append((cls, rid, '' if VOLATILE_TEXT.match(text) else text,
+                      node.get('content-desc', ''), node.get('bounds', ''),
+                      node.get('checked', ''), node.get('selected', '')))
+    return tuple(parts)
+
+def ui_fingerprint(xml:bytes) -> int:
+    """In-process hash of `ui_signature`; transitions.screen_key is the one stable across runs"""
+    return hash(ui_signature(xml))
+
+def wait_until_stable(max_wait:float, matches:int = 2, interval:float = 0.2):
+    """Dump until `matches` consecutive fingerprints agree or `max_wait` runs out.
+    Returns (stable, seconds actually waited, seconds until the settled screen first showed up)"""
+    start = time.time()
+    last, same, streak_start = None, 0, 0.
+    while True:
+        taken = time.time() - start
+        try:
+            fp = ui_fingerprint(dump_ui())
+        except (RuntimeError, ET.ParseError):
+            fp = None
+        if fp is not None and fp == last:
+            same += 1
+        else:
+            same, streak_start = 0, taken
+        last = fp
+        elapsed = time.time() - start
+        if same + 1 >= matches and fp is not None:
+            return True, elapsed, streak_start
+        if elapsed + interval >= max_wait:
+            time.sleep(max(0, max_wait - elapsed))
+            return False, time.time() - start, time.time() - start
+        time.sleep(interval)
+
+def _settle_key():
+    """(package, activity) in the foreground; the package comes from the window manager when
+    the last resume event only named a class"""
+    app, activity = activity_watcher().foreground()
+    if app is None:
+        m = _FOCUS.search(get_current_activity())
+        if m:
+            app = m.group(1)
+            activity = activity or (app + m.group(2) if m.group(2).startswith('.') else m.group(2))
+    return app, activity
+
+def sleep_budget(kind:str = 'wait') -> float:
+    """What `sleep=None` resolves to where the UI cannot be watched (e.g. inside an input batch)"""
+    if configs.SETTLE == configs.SettleConf.ADAPTIVE and kind in ADAPTIVE_KINDS:
+        app, activity = _settle_key()
+        budget = latency.get_store().budget(app, kind, activity, DEFAULT_SLEEP)
+        if budget is not None:
+            return round(budget, 2)
+    return DEFAULT_SLEEP
+
+def _adaptive_settle(seconds, kind:str):
+    store = latency.get_store()
+    app, activity = _settle_key()
+    fixed = DEFAULT_SLEEP if seconds is None else seconds
+    budget = store.budget(app, kind, activity, fixed) if seconds is None else None
+    if budget is not None and not store.should_explore(app, kind, activity, fixed):
+        time.sleep(budget)
+        return budget
+    max_wait = max(fixed, budget or 0)
+    if seconds is None:
+        # the default sleep is too short for two dumps, learning it needs a longer look
+        max_wait = max(max_wait, configs.SETTLE_MIN_WAIT)
+    elif max_wait < configs.SETTLE_MIN_WAIT:
+        # too short for two dumps: a measurement would be the dump's own latency
+        time.sleep(max_wait)
+        return max_wait
+    stable, waited, settled = wait_until_stable(max_wait)
+    store.record(app, kind, activity, settled, fixed)
+    return waited
+
+def settle(seconds = None, kind:str = 'wait'):
+    """Post-action wait: a fixed sleep, at most `seconds` until the UI settles under SettleConf.STABLE,
+    or a learned per-(app, kind, activity) wait under SettleConf.ADAPTIVE"""
+    if configs.SETTLE == configs.SettleConf.ADAPTIVE and kind in ADAPTIVE_KINDS:
+        return _adaptive_settle(seconds, kind)
+    seconds = DEFAULT_SLEEP if seconds is None else seconds
+    if configs.SETTLE == configs.SettleConf.STABLE and seconds >= configs.SETTLE_MIN_WAIT:
+        return wait_until_stable(seconds)[1]
+    time.sleep(seconds)
+    return seconds
+
+class InputBatch:
+    """Collects input/pm commands and sleeps, and ships them to the device as one shell script"""
+
+    def __init__(self):
+        self.lines = []
+
+    def add(self, cmd:str, sleep = 0):
+        self.lines.append(cmd)
+        self.sleep(sleep)
+
+    def sleep(self, seconds):
+        if seconds:
+            self.lines.append(f'sleep {seconds}')
+
+    def tap(self, x, y, sleep = 0.5):
+        self.add(f'input tap {x} {y}', sleep)
+
+    def keyevent(self, key:str, sleep = 0.5):
+        self.add(f'input keyevent {key}', sleep)
+
+    def text(self, text:str, sleep = 0.5):
+        self.add(f'input text {text}', sleep)
+
+    def grant(self, pkg:str, permission:str, sleep = 0.5):
+        self.add(f'pm grant {pkg} {permission}', sleep)
+
+    def flush(self) -> bytes:
+        if not self.lines:
+            return b''
+        script, self.lines = '\n'.join(self.lines), []
+        # the device-side sleeps count against the timeout too
+        slept = sum(float(line.split()[1]) for line in script.splitlines() if line.startswith('sleep '))
+        return adb_shell(script, adb_client.SHELL_TIMEOUT + slept)
+
+    def __enter__(self):
+        _batches.stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _batches.stack.pop()
+        if exc_type is None:
+            self.flush()
+
+class _BatchStack(threading.local):
+    def __init__(self):
+        self.stack = []
+
+_batches = _BatchStack()
+
+def input_batch() -> InputBatch:
+    """`with input_batch():` makes adb_input/adb_pm/adb_sleep calls in the block run as one round trip"""
+    return InputBatch()
+
+def active_batch():
+    return _batches.stack[-1] if _batches.stack else None
+
+def adb_sleep(seconds):
+    batch = active_batch()
+    if batch is not None:
+        # device-side sleeps inside a batch cannot look at the UI, they stay fixed
+        batch.sleep(seconds)
+    else:
+        settle(seconds)
 
-def adb_input(cmd:str, sleep = 0.5):
+def adb_input(cmd:str, sleep = None):
+    batch = active_batch()
+    if batch is not None:
+        return batch.add(f'input {cmd}', sleep if sleep is not None else sleep_budget(action_kind(f'input {cmd}')))
     adb_exec(f'input {cmd}', sleep)
 
-def adb_pm(cmd:str, sleep = 0.5):
+def adb_pm(cmd:str, sleep = None):
+    batch = active_batch()
+    if batch is not None:
+        return batch.add(f'pm {cmd}', sleep if sleep is not None else sleep_budget('pm'))
     adb_exec(f'pm {cmd}', sleep)
 
 def adb_pull(name, target = None):
-    os.system(f'adb pull {name}' + f" {target}" if target else '')
-
-def adb_tap_center(bounds, sleep = 0.5):
+    target = target if target else os.path.basename(name)
+    try:
+        data = adb_client.client.pull(current_serial(), name)
+    except adb_client.AdbUnavailable:
+        os.system(f'adb -s {current_serial()} pull {name} {target}')
+        return
+    with open(target, 'wb') as f:
+        f.write(data)
+
+def adb_tap_center(bounds, sleep = None):
     if type(bounds) == str:
         bounds = transform_bounds(bounds)
     adb_input(f'tap {(bounds[0][0] + bounds[1][0]) // 2} {(bounds[0][1] + bounds[1][1]) // 2}', sleep)
@@ -47,21 +295,183 @@ def get_current_ui():
     adb_pull('/sdcard/window_dump.xml', 'hierarchy.xml')
     return ET.parse('hierarchy.xml')
 
+def dump_ui() -> bytes:
+    """Dump the current hierarchy straight into memory, without touching /sdcard or the CWD"""
+    for dev in ('/dev/tty', '/dev/stdout'):
+        out = adb_exec_out(f'uiautomator dump {dev}')
+        start, end = out.find(b'<?xml'), out.rfind(b'</hierarchy>')
+        if start >= 0 and end >= 0:
+            return out[start:end + len('</hierarchy>')]
+    raise RuntimeError('uiautomator dump failed: ' + out.decode(errors='replace').strip())
+
+def get_current_ui_tree() -> ET.ElementTree:
+    """In-memory counterpart of `get_current_ui`"""
+    return ET.ElementTree(ET.fromstring(dump_ui()))
+
 def save_current_ui(path):
     print(str(path))
-    adb_exec('uiautomator dump')
-    adb_pull('/sdcard/window_dump.xml', str(path))
+    with open(path, 'wb') as f:
+        f.write(dump_ui())
+
+_encoder = ThreadPoolExecutor(max_workers=2, thread_name_prefix='png-encoder')
+_sdk_versions = {}
+
+def get_sdk_version() -> int:
+    serial = current_serial()
+    if serial not in _sdk_versions:
+        _sdk_versions[serial] = int(adb_shell('getprop ro.build.version.sdk').strip() or 0)
+    return _sdk_versions[serial]
+
+def _readinto_exact(readinto, view):
+    got = 0
+    while got < len(view):
+        n = readinto(view[got:])
+        if not n:
+            raise adb_client.AdbError('screencap stream ended early')
+        got += n
+
+def _screen_header_size() -> int:
+    # `screencap` without -p: u32 width, height, format (+ u32 colorspace since Android 9), then RGBA_8888
+    return 16 if get_sdk_version() >= 28 else 12
+
+def parse_raw_screen(data:bytes):
+    """View a raw `screencap` dump as an (H, W, 4) array without copying"""
+    import numpy as np
+    width, height, fmt = struct.unpack_from('<III', data)
+    if fmt != 1:
+        raise ValueError(f'unsupported framebuffer format {fmt}')
+    return np.frombuffer(data, dtype=np.uint8, count=width * height * 4,
+                         offset=_screen_header_size()).reshape(height, width, 4)
+
+def _capture_raw(out = None):
+    import numpy as np
+    header_size = _screen_header_size()
+    try:
+        sock = adb_client.client.open_exec(current_serial(), 'screencap')
+        readinto, close = sock.recv_into, sock.close
+    except adb_client.AdbUnavailable:
+        proc = subprocess.Popen(['adb', '-s', current_serial(), 'exec-out', 'screencap'], stdout=subprocess.PIPE)
+        readinto, close = proc.stdout.readinto, proc.stdout.close
+    try:
+        header = bytearray(header_size)
+        _readinto_exact(readinto, memoryview(header))
+        width, height, fmt = struct.unpack_from('<III', header)
+        if fmt != 1:
+            raise ValueError(f'unsupported framebuffer format {fmt}')
+        if out is None or out.shape != (height, width, 4) or out.dtype != np.uint8:
+            out = np.empty((height, width, 4), dtype=np.uint8)
+        _readinto_exact(readinto, memoryview(out).cast('B'))
+    finally:
+        close()
+    return out
+
+def get_current_screen(scale:int = 1, gray:bool = False, out = None):
+    """Grab the framebuffer as an (H, W, 4) RGBA uint8 array; `out` is reused when its shape matches.
+    `scale` downsamples by block-averaging, `gray` returns an (H, W) luma array"""
+    import numpy as np
+    img = _capture_raw(out)
+    if scale > 1:
+        h, w = img.shape[0] // scale * scale, img.shape[1] // scale * scale
+        img = img[:h, :w].reshape(h // scale, scale, w // scale, scale, 4).mean(axis=(1, 3))
+    if gray:
+        img = img[..., :3] @ np.array([0.299, 0.587, 0.114])
+    return img if img.dtype == np.uint8 else img.astype(np.uint8)
+
+def encode_png(img) -> bytes:
+    """Encode an RGBA/gray uint8 array as PNG with zlib only"""
+    height, width = img.shape[:2]
+    color_type = {2: 0, 3: 6}[img.ndim]
+    raw = b''.join(b'\x00' + img[y].tobytes() for y in range(height))
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 3)) + chunk(b'IEND', b''))
+
+def _write_png(path, img):
+    with open(path, 'wb') as f:
+        f.write(encode_png(img))
 
 def save_current_screen(path):
+    """Capture now, encode and write the PNG in the background; returns the pending future"""
     print(str(path))
-    os.system("adb exec-out screencap -p > " + str(path))
-
-def get_current_screen():
-    raise NotImplementedError('Cannot get current screen yet!')
+    return _encoder.submit(_write_png, path, _capture_raw())
 
 def get_current_activity() -> str:
-	return subprocess.check_output(['adb', 'shell',
-		"dumpsys window windows | grep -E 'mCurrentFocus|mFocusedApp'"]).decode()
+	return adb_shell("dumpsys window windows | grep -E 'mCurrentFocus|mFocusedApp'").decode()
+
+_FOCUS = re.compile(r'mCurrentFocus=Window\{\S+ \S+ ([^/\s}]+)/([^\s}]+)')
+_OBSERVE_SCRIPT = ("d=/data/local/tmp/fv_obs_$$; mkdir -p $d; "
+    "uiautomator dump $d/ui.xml >/dev/null 2>&1; "
+    "{screencap}"
+    "dumpsys window windows | grep -E 'mCurrentFocus|mFocusedApp' > $d/act.txt; "
+    "for f in {files}; do echo \"$f $(stat -c %s $d/$f 2>/dev/null || echo 0)\"; cat $d/$f 2>/dev/null; done; "
+    "rm -rf $d")
+
+TRANSITION_MIN_NODES = 5
+
+class Observation:
+    """What one device round trip tells us about the current state"""
+
+    def __init__(self, hierarchy:str, screen, focus:str):
+        self.hierarchy = hierarchy
+        self.screen = screen
+        self.focus = focus
+        m = _FOCUS.search(focus)
+        self.package = m.group(1) if m else None
+        self.activity = None
+        if m:
+            self.activity = self.package + m.group(2) if m.group(2).startswith('.') else m.group(2)
+
+        self._tree = None
+        self._fingerprint = None
+
+    def tree(self) -> ET.ElementTree:
+        """Parsed once and shared by every consumer of this observation"""
+        if self._tree is None:
+            self._tree = ET.ElementTree(ET.fromstring(self.hierarchy))
+        return self._tree
+
+    def fingerprint(self) -> int:
+        if self._fingerprint is None:
+            self._fingerprint = ui_fingerprint(self.hierarchy.encode('utf-8'))
+        return self._fingerprint
+
+    def in_transition(self, pkg:str = None) -> bool:
+        """Heuristic: a near-empty tree, a visible spinner or another app in focus"""
+        nodes = list(self.tree().iter('node'))
+        if len(nodes) < TRANSITION_MIN_NODES:
+            return True
+        if pkg is not None and self.package is not None and self.package != pkg:
+            return True
+        return any(n.get('class', '').endswith('ProgressBar') for n in nodes)
+
+    def save(self, xml_path = None, png_path = None):
+        """Write the hierarchy now and the screenshot in the background"""
+        if xml_path is not None:
+            with open(xml_path, 'w', encoding='utf-8') as f:
+                f.write(self.hierarchy)
+        if png_path is not None and self.screen is not None:
+            return _encoder.submit(_write_png, png_path, self.screen)
+
+def _split_frames(data:bytes) -> dict:
+    frames, pos = {}, 0
+    while pos < len(data):
+        eol = data.index(b'\n', pos)
+        name, size = data[pos:eol].decode().split(' ')
+        pos = eol + 1 + int(size)
+        frames[name] = data[eol + 1:pos]
+    return frames
+
+def capture_observation(screen:bool = True) -> Observation:
+    """Hierarchy, screenshot and focused window in a single device round trip"""
+    files = 'ui.xml screen.raw act.txt' if screen else 'ui.xml act.txt'
+    frames = _split_frames(adb_exec_out(_OBSERVE_SCRIPT.format(
+        screencap='screencap $d/screen.raw; ' if screen else '', files=files)))
+    if not frames.get('ui.xml'):
+        raise RuntimeError('uiautomator dump failed')
+    raw = frames.get('screen.raw')
+    return Observation(frames['ui.xml'].decode('utf-8'), parse_raw_screen(raw) if raw else None,
+                       frames['act.txt'].decode(errors='replace'))
 
 def get_package_name(apk) -> str:
     """Get the package name of an APK"""
@@ -71,7 +481,7 @@ def get_package_name(apk) -> str:
         if apk in configs.apk_info:
             return configs.apk_info[apk]['package']
         apk_path = Path(configs.apk_dir)/f"{apk}.apk"
-    return subprocess.check_output(["aapt", "dump", "badging", apk_path]).decode().split("package: name='")[1].split("'")[0]
+    return apk_cache.get_cache().get(apk_path)['package']
 
 def get_account(apk:str) -> tuple:
     """Get the account for an app"""
@@ -86,14 +496,14 @@ def check_activity(acts):
     return any([act in cur_act for act in acts])
 
 def install_apk(apk:str):
-    print(f"adb install -r {configs.apk_dir}/{apk}.apk")
-    os.system(f"adb install -r {configs.apk_dir}/{apk}.apk")
+    print(f"adb -s {current_serial()} install -r {configs.apk_dir}/{apk}.apk")
+    os.system(f"adb -s {current_serial()} install -r {configs.apk_dir}/{apk}.apk")
 def uninstall_pkg(pkg:str):
-    os.system(f"adb uninstall {pkg}")
+    os.system(f"adb -s {current_serial()} uninstall {pkg}")
 
 def check_installed(apk:str, pkg:str = None) -> bool:
     pkg = pkg if pkg else get_package_name(apk)
-    return bool(subprocess.check_output(['adb', 'shell', 'pm', 'list', 'packages', pkg]).decode())
+    return bool(adb_shell(f'pm list packages {pkg}').decode())
 
 def ensure_installed(apk, pkg:str = None):
     pkg = pkg if pkg else get_package_name(apk)
@@ -103,38 +513,85 @@ def ensure_installed(apk, pkg:str = None):
     else:
         return True
 
+_last_reset = {}
+
+def reset_app(apk:str, pkg:str = None) -> str:
+    """Reset the app as configured by `reset.mode`; returns the mode that was actually used"""
+    pkg = pkg if pkg else get_package_name(apk)
+    mode = configs.reset_mode
+    if mode == 'snapshot' and snapshot.restore_app_snapshot(current_serial(), apk):
+        used = 'snapshot'
+    elif mode == 'data' and check_installed(apk, pkg):
+        adb_pm(f'clear {pkg}', 0)
+        used = 'data'
+    else:
+        if check_installed(apk, pkg):
+            uninstall_pkg(pkg)
+        ensure_installed(apk, pkg)
+        used = 'reinstall'
+    _last_reset[(current_serial(), apk)] = used
+    return used
+
+def last_reset(apk:str) -> str:
+    """How `apk` was last reset on the current device, None if it was not reset in this process"""
+    return _last_reset.get((current_serial(), apk))
+
 def ensure_reinstalled(apk:str, pkg:str = None):
     pkg = pkg if pkg else get_package_name(apk)
-    if check_installed(apk, pkg):
-        uninstall_pkg(pkg)
-    return ensure_installed(apk, pkg)
+    reset_app(apk, pkg)
+    return check_installed(apk, pkg)
 def uninstall_app(apk:str, pkg:str = None):
     pkg = pkg if pkg else get_package_name(apk)
     uninstall_pkg(pkg)
-def start_app(apk:str = None, pkg:str = None):
+def activity_watcher() -> event_watcher.ActivityWatcher:
+    return event_watcher.get_watcher(current_serial())
+
+def start_app(apk:str = None, pkg:str = None, wait_event:bool = False):
+    """With `wait_event`, return as soon as the app resumes (at most the usual 4 s) instead of sleeping"""
     pkg = pkg if pkg else get_package_name(apk)
     print(pkg)
+    since = activity_watcher().mark() if wait_event else None
     #adb_exec(f"monkey -p {pkg} -c android.intent.category.LAUNCHER 1",1)
     if pkg == "com.espn.score_center":
-        adb_exec(f"am start {pkg}/com.espn.sportscenter.ui.EspnLaunchActivity")
+        adb_exec(f"am start {pkg}/com.espn.sportscenter.ui.EspnLaunchActivity", 0 if wait_event else 0.5)
     else:
-        adb_exec(f"monkey -p {pkg} 1",4)
+        adb_exec(f"monkey -p {pkg} 1", 0 if wait_event else 4)
+    if wait_event:
+        wait_for_package(pkg, 4, since)
 
-def restart_app(apk:str = None, pkg:str = None):
+def restart_app(apk:str = None, pkg:str = None, wait_event:bool = False):
     pkg = pkg if pkg else get_package_name(apk)
-    adb_exec(f"am force-stop {pkg}",2)
-    start_app(pkg=pkg)
+    # force-stop returns once the process is gone, the fixed sleep is only needed without events
+    adb_exec(f"am force-stop {pkg}", 0 if wait_event else 2)
+    start_app(pkg=pkg, wait_event=wait_event)
+
+def wait_for_package(pkg:str, timeout = 5, since:int = None) -> bool:
+    """Block until an activity of `pkg` resumes after `since` (a watcher mark)"""
+    watcher = activity_watcher()
+    since = watcher.mark() if since is None else since
+    deadline = time.time() + timeout
+    while True:
+        e = watcher.wait(lambda e: True, deadline - time.time(), since)
+        if e is None:
+            return pkg in get_current_activity()
+        if e.match_package(pkg):
+            return True
+        # a resume whose package the watcher cannot tell: ask the window manager once
+        if not e.packages and pkg in get_current_activity():
+            return True
+        since = e.seq
 
 def wait_for_activity(acts, timeout=5):
     if type(acts) is str:
         acts = [acts]
-    for retry in range(timeout-1):
-        if check_activity(acts):
-            return True
-        time.sleep(2)
+    watcher = activity_watcher()
+    since = watcher.mark()
     if check_activity(acts):
         return True
-    return False
+    # same budget as the old 2 s polling loop, but returns as soon as the activity resumes
+    if watcher.wait_for_activity(acts, 2 * (timeout - 1), since) is not None:
+        return True
+    return check_activity(acts)
 
 import json
 